@@ -0,0 +1,121 @@
+import csv
+import json
+
+from django.conf import settings
+
+
+class Echo:
+    """Файлоподобный объект для `csv.writer`: возвращает записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListExporter:
+    """Базовый формат потоковой выгрузки списка покупок.
+
+    Строки читаются курсором на стороне сервера и отдаются пачками по
+    `SHOPPING_LIST_CHUNK_SIZE`, поэтому память не зависит от размера корзины.
+    """
+
+    content_type = None
+    extension = None
+
+    def __init__(self, user, ingredients):
+        self.user = user
+        self.ingredients = ingredients
+
+    @property
+    def filename(self):
+        return f'{self.user.username}_shopping_list.{self.extension}'
+
+    def header(self):
+        return ''
+
+    def render_row(self, row, index):
+        raise NotImplementedError
+
+    def footer(self):
+        return ''
+
+    def __iter__(self):
+        chunk_size = settings.SHOPPING_LIST_CHUNK_SIZE
+        chunk = [self.header()]
+        rows = self.ingredients.iterator(chunk_size=chunk_size)
+        for index, row in enumerate(rows):
+            chunk.append(self.render_row(row, index))
+            if len(chunk) >= chunk_size:
+                yield ''.join(chunk)
+                chunk = []
+        chunk.append(self.footer())
+        yield ''.join(chunk)
+
+
+class TextExporter(ShoppingListExporter):
+    """Список покупок в виде текстового файла."""
+
+    content_type = 'text/plain; charset=utf-8'
+    extension = 'txt'
+
+    def header(self):
+        return f'Список покупок для: {self.user.first_name}\n'
+
+    def render_row(self, row, index):
+        return (
+            f'{row["name"]}: {row["amount"]}'
+            f'{row["measurement_unit"]}\n'
+        )
+
+    def footer(self):
+        return '\nПосчитано в Foodgram'
+
+
+class CsvExporter(ShoppingListExporter):
+    """Список покупок в формате CSV."""
+
+    content_type = 'text/csv; charset=utf-8'
+    extension = 'csv'
+
+    def __init__(self, user, ingredients):
+        super().__init__(user, ingredients)
+        self.writer = csv.writer(Echo())
+
+    def header(self):
+        return self.writer.writerow(
+            ('Ингредиент', 'Количество', 'Единица измерения')
+        )
+
+    def render_row(self, row, index):
+        return self.writer.writerow(
+            (row['name'], row['amount'], row['measurement_unit'])
+        )
+
+
+class JsonExporter(ShoppingListExporter):
+    """Список покупок в виде JSON-массива."""
+
+    content_type = 'application/json; charset=utf-8'
+    extension = 'json'
+
+    def header(self):
+        return '['
+
+    def render_row(self, row, index):
+        item = json.dumps(
+            {
+                'name': row['name'],
+                'amount': row['amount'],
+                'measurement_unit': row['measurement_unit'],
+            },
+            ensure_ascii=False,
+        )
+        return f',{item}' if index else item
+
+    def footer(self):
+        return ']'
+
+
+EXPORTERS = {
+    exporter.extension: exporter
+    for exporter in (TextExporter, CsvExporter, JsonExporter)
+}
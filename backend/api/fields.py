@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from drf_extra_fields.fields import Base64ImageField
+
+
+class RecipeImageField(Base64ImageField):
+    """Изображение рецепта в base64 с ограничениями на размер.
+
+    Объём проверяется по длине строки до декодирования, размеры - по
+    заголовку файла без декодирования пикселей. В ответе отдаётся URL
+    уменьшенной копии `variant` (или подходящей к действию вьюсета), пока
+    копии не готовы - оригинал.
+    """
+
+    def __init__(self, *args, variant=None, **kwargs):
+        self.variant = variant
+        super().__init__(*args, **kwargs)
+
+    def to_internal_value(self, base64_data):
+        if isinstance(base64_data, str):
+            encoded = base64_data.partition(';base64,')[2] or base64_data
+            if len(encoded) * 3 // 4 > settings.MAX_IMAGE_BYTES:
+                raise ValidationError(
+                    'Изображение больше '
+                    f'{settings.MAX_IMAGE_BYTES // 1024 // 1024} МБ.'
+                )
+        value = super().to_internal_value(base64_data)
+        image = getattr(value, 'image', None)
+        if image is not None and max(image.size) > settings.MAX_IMAGE_SIDE:
+            raise ValidationError(
+                'Сторона изображения больше '
+                f'{settings.MAX_IMAGE_SIDE} пикселей.'
+            )
+        return value
+
+    def get_variant(self):
+        if self.variant is not None:
+            return self.variant
+        view = self.context.get('view')
+        return settings.IMAGE_VARIANT_FOR_ACTION.get(
+            getattr(view, 'action', None)
+        )
+
+    def to_representation(self, file):
+        if not file:
+            return None
+        variants = getattr(file.instance, 'image_variants', None) or {}
+        name = variants.get(self.get_variant())
+        if variants.get('source') != file.name or name is None:
+            return super().to_representation(file)
+        url = file.storage.url(name)
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
@@ -1,18 +1,38 @@
-from django_filters.rest_framework import FilterSet, NumberFilter, filters
-from rest_framework.filters import SearchFilter
+from django.db.models import Case, IntegerField, When
+from django_filters.rest_framework import (CharFilter, ChoiceFilter,
+                                           FilterSet, MultipleChoiceFilter,
+                                           NumberFilter)
 
-from recipes.models import Tag, Recipe
+from recipes import tag_masks, trigrams
+from recipes.models import Recipe, TrigramEntry
+
+
+def tag_choices():
+    return [(slug, slug) for slug in tag_masks.get_tags()]
 
 
 class RecipeFilters(FilterSet):
     author = NumberFilter(field_name='author__id')
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all()
+    tags = MultipleChoiceFilter(choices=tag_choices, method='filter_tags')
+    tags_match = ChoiceFilter(
+        choices=(('any', 'any'), ('all', 'all')),
+        method='filter_tags_match',
     )
     is_favorited = NumberFilter(method='filter_is_favorited')
     is_in_shopping_cart = NumberFilter(method='filter_shopping_cart')
+    search = CharFilter(method='filter_search')
+
+    def filter_tags(self, queryset, name, value):
+        """Любой из тегов, с `tags_match=all` - все сразу, по маске."""
+        if not value:
+            return queryset
+        return tag_masks.filter_by_tags(
+            queryset, value,
+            match_all=self.form.cleaned_data.get('tags_match') == 'all',
+        )
+
+    def filter_tags_match(self, queryset, name, value):
+        return queryset
 
     def filter_is_favorited(self, queryset, name, value):
         if value:
@@ -24,11 +44,21 @@ class RecipeFilters(FilterSet):
             return queryset.filter(cart=self.request.user.id)
         return queryset
 
+    def filter_search(self, queryset, name, value):
+        """Нечёткий поиск по названию, самые похожие рецепты первыми."""
+        ids = [
+            object_id for object_id, _
+            in trigrams.search(TrigramEntry.RECIPE, value)
+        ]
+        return queryset.filter(id__in=ids).order_by(Case(
+            *(When(id=object_id, then=rank)
+              for rank, object_id in enumerate(ids)),
+            output_field=IntegerField(),
+        ))
+
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
-
-
-class IngredientSearchFilterSet(SearchFilter):
-    """Поиск по названию ингредиента."""
-    search_param = 'name'
+        fields = (
+            'author', 'tags', 'tags_match', 'is_favorited',
+            'is_in_shopping_cart', 'search',
+        )
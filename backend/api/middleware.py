@@ -0,0 +1,108 @@
+import json
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('api.slow_requests')
+
+
+class QueryRecorder:
+    """Обёртка `execute_wrapper`: число запросов, время и повторы SQL."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+
+    @property
+    def duplicates(self):
+        return sum(
+            count - 1 for count in self.statements.values() if count > 1
+        )
+
+
+def view_name(view_func, method):
+    """`RecipeViewSet.list`, `UserViewSet.subscriptions`, `upload_image`."""
+    actions = getattr(view_func, 'actions', None)
+    if actions:
+        method = method.lower()
+        return f'{view_func.cls.__name__}.{actions.get(method, method)}'
+    if hasattr(view_func, 'cls'):
+        return view_func.__name__
+    return f'{view_func.__module__}.{view_func.__name__}'
+
+
+class SQLInstrumentationMiddleware:
+    """Считает SQL каждого запроса, отдаёт `Server-Timing` и пишет
+    медленные запросы в лог `api.slow_requests`.
+
+    Включается `SQL_INSTRUMENTATION`; выключенный middleware Django
+    исключает из цепочки при старте.
+    """
+
+    def __init__(self, get_response):
+        if not settings.SQL_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        total = time.perf_counter() - started
+
+        response['Server-Timing'] = (
+            f'db;dur={recorder.duration * 1e3:.2f};'
+            f'desc="{recorder.count} queries", '
+            f'total;dur={total * 1e3:.2f}'
+        )
+        self.log_if_slow(request, response, recorder, total)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.instrumented_view = view_name(view_func, request.method)
+
+    def log_if_slow(self, request, response, recorder, total):
+        reasons = [
+            reason for reason, exceeded in (
+                ('time', total * 1e3 >= settings.SLOW_REQUEST_MS),
+                ('queries', recorder.count >= settings.SLOW_REQUEST_QUERIES),
+                ('duplicates',
+                 recorder.duplicates >= settings.SLOW_REQUEST_DUPLICATES),
+            ) if exceeded
+        ]
+        if not reasons:
+            return
+        logger.warning(json.dumps({
+            'view': getattr(request, 'instrumented_view', None),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'reasons': reasons,
+            'total_ms': round(total * 1e3, 2),
+            'db_ms': round(recorder.duration * 1e3, 2),
+            'queries': recorder.count,
+            'duplicates': recorder.duplicates,
+            'top_repeated': [
+                {'sql': sql[:300], 'count': count}
+                for sql, count in recorder.statements.most_common(3)
+                if count > 1
+            ],
+        }, ensure_ascii=False))
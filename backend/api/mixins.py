@@ -1,15 +1,227 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, router, transaction
+from django.db.models import Exists, OuterRef
+from django.db.models.signals import m2m_changed
+from django.http import Http404
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from rest_framework import status
 from rest_framework.response import Response
 
+from .relations import get_relations
+from .serializers import BatchIdsSerializer
+from recipes.versions import get_modified, get_version, get_versions
+
+
+class NotModified(Exception):
+    """Прерывает обработку запроса готовым ответом 304."""
+
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+
+
+def make_etag(*parts):
+    """Сильный ETag из произвольных значений."""
+    return quote_etag(
+        hashlib.md5('|'.join(map(str, parts)).encode()).hexdigest()
+    )
+
+
+def choose_encoding(request, available):
+    """Лучшее из сжатий `available`, которое принимает клиент.
+
+    Разбирает `Accept-Encoding` с учётом `q`; без подходящего -
+    `identity`.
+    """
+    accepted = {}
+    header = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    for coding in ('br', 'gzip'):
+        if coding in available and accepted.get(
+            coding, accepted.get('*', 0)
+        ) > 0:
+            return coding
+    return 'identity'
+
+
+class ConditionalGetMixin:
+    """Отвечает 304 на условные GET-запросы до выборки и сериализации.
+
+    Валидаторы считаются после аутентификации и проверки прав.
+    """
+
+    version_name = None
+    etag = None
+    last_modified = None
+
+    def get_validators(self, request):
+        """Возвращает пару `(etag, last_modified)`.
+
+        По умолчанию - версия набора данных `version_name`, ETag также
+        зависит от строки запроса.
+        """
+        if self.version_name is None:
+            return None, None
+        return (
+            make_etag(
+                get_version(self.version_name), request.get_full_path()
+            ),
+            get_modified(self.version_name),
+        )
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method not in ('GET', 'HEAD'):
+            return
+        self.etag, self.last_modified = self.get_validators(request)
+        response = get_conditional_response(
+            request, etag=self.etag, last_modified=self.last_modified
+        )
+        if response is not None:
+            raise NotModified(response)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        if response.status_code in (status.HTTP_200_OK, 304):
+            if self.etag and not response.has_header('ETag'):
+                response['ETag'] = self.etag
+            if self.last_modified and not response.has_header(
+                'Last-Modified'
+            ):
+                response['Last-Modified'] = http_date(self.last_modified)
+        return response
+
+
+def add_link(manager, obj_id):
+    """Добавляет строку связи одним запросом `INSERT ... SELECT`.
+
+    Конфликт с уникальным индексом таблицы связи пропускается, поэтому
+    повторный или параллельный запрос ничего не меняет. Возвращает
+    `True`, если строка добавлена.
+    """
+    through = manager.through
+    db = router.db_for_write(through, instance=manager.instance)
+    connection = connections[db]
+    ops = connection.ops
+    qn = ops.quote_name
+    model = manager.model._meta
+    sql = (
+        f'{ops.insert_statement(ignore_conflicts=True)} '
+        f'{qn(through._meta.db_table)} ('
+        f'{qn(through._meta.get_field(manager.source_field_name).column)}, '
+        f'{qn(through._meta.get_field(manager.target_field_name).column)}) '
+        f'SELECT %s, {qn(model.pk.column)} FROM {qn(model.db_table)} '
+        f'WHERE {qn(model.pk.column)} = %s '
+        f'{ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, (manager.instance.pk, obj_id))
+        added = cursor.rowcount > 0
+    if added:
+        send_m2m_changed(manager, 'post_add', {obj_id}, db)
+    return added
+
+
+def remove_link(manager, obj_id):
+    """Удаляет строку связи одним `DELETE`, `True` - если она была."""
+    through = manager.through
+    db = router.db_for_write(through, instance=manager.instance)
+    deleted, _ = through._default_manager.using(db).filter(**{
+        f'{manager.source_field_name}_id': manager.instance.pk,
+        f'{manager.target_field_name}_id': obj_id,
+    }).delete()
+    if deleted:
+        send_m2m_changed(manager, 'post_remove', {obj_id}, db)
+    return bool(deleted)
+
+
+def change_links(manager, obj_ids, adding):
+    """Добавляет или удаляет связи с объектами `obj_ids` одним запросом.
+
+    Возвращает множество id, строки которых действительно изменены
+    (`RETURNING`): строки, которые параллельный запрос успел добавить
+    или удалить раньше, в результат не попадают и дважды не считаются.
+    """
+    through = manager.through
+    db = router.db_for_write(through, instance=manager.instance)
+    connection = connections[db]
+    ops = connection.ops
+    qn = ops.quote_name
+    model = manager.model._meta
+    table = qn(through._meta.db_table)
+    source = qn(through._meta.get_field(manager.source_field_name).column)
+    target = qn(through._meta.get_field(manager.target_field_name).column)
+    obj_ids = list(obj_ids)
+    placeholders = ', '.join(['%s'] * len(obj_ids))
+    if adding:
+        sql = (
+            f'{ops.insert_statement(ignore_conflicts=True)} {table} '
+            f'({source}, {target}) '
+            f'SELECT %s, {qn(model.pk.column)} FROM {qn(model.db_table)} '
+            f'WHERE {qn(model.pk.column)} IN ({placeholders}) '
+            f'{ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)} '
+            f'RETURNING {target}'
+        )
+    else:
+        sql = (
+            f'DELETE FROM {table} WHERE {source} = %s '
+            f'AND {target} IN ({placeholders}) RETURNING {target}'
+        )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, (manager.instance.pk, *obj_ids))
+        return {row[0] for row in cursor.fetchall()}
+
+
+def send_m2m_changed(manager, action, pk_set, db):
+    """`m2m_changed`, как у `manager.add`/`remove`; `pre_*` не шлются,
+    строка уже изменена."""
+    m2m_changed.send(
+        sender=manager.through,
+        action=action,
+        instance=manager.instance,
+        reverse=manager.reverse,
+        model=manager.model,
+        pk_set=pk_set,
+        using=db,
+    )
+
 
 class AddDelViewMixin:
     """Добавляет во Viewset дополнительные методы."""
 
     add_serializer = None
 
+    def relation_changed(self, manager, pks, added):
+        """Вызывается в той же транзакции после добавления/удаления связей
+        с объектами `pks`."""
+
     def add_del_obj(self, obj_id, manager):
-        """Добавляет/удаляет связь через менеджер `model.many-to-many`."""
+        """Добавляет/удаляет связь через таблицу `model.many-to-many`.
+
+        Связь меняется одним условным запросом; 400 - если менять нечего,
+        404 - если объекта нет.
+        """
         assert self.add_serializer is not None, (
             f'{self.__class__.__name__} should include '
             'an `add_serializer` attribute.'
@@ -18,18 +230,146 @@ class AddDelViewMixin:
         user = self.request.user
         if user.is_anonymous:
             return Response(status=status.HTTP_401_UNAUTHORIZED)
+        try:
+            obj_id = int(obj_id)
+        except (TypeError, ValueError):
+            raise Http404
 
-        obj = get_object_or_404(self.queryset, id=obj_id)
-        serializer = self.add_serializer(
-            obj, context={'request': self.request}
-        )
-        obj_exist = manager.filter(id=obj_id).exists()
-
-        if (self.request.method in ('GET', 'POST',)) and not obj_exist:
-            manager.add(obj)
+        if self.request.method in ('GET', 'POST',):
+            obj = get_object_or_404(self.queryset, id=obj_id)
+            with transaction.atomic():
+                added = add_link(manager, obj_id)
+                if added:
+                    self.relation_changed(manager, {obj_id}, added=True)
+            if not added:
+                return Response(status=status.HTTP_400_BAD_REQUEST)
+            get_relations(self.request).changed(
+                manager.prefetch_cache_name, {obj_id}, added=True
+            )
+            serializer = self.add_serializer(
+                obj, context={'request': self.request}
+            )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-        if (self.request.method in ('DELETE',)) and obj_exist:
-            manager.remove(obj)
-            return Response(status=status.HTTP_204_NO_CONTENT)
+        if self.request.method in ('DELETE',):
+            with transaction.atomic():
+                removed = remove_link(manager, obj_id)
+                if removed:
+                    self.relation_changed(manager, {obj_id}, added=False)
+            if removed:
+                get_relations(self.request).changed(
+                    manager.prefetch_cache_name, {obj_id}, added=False
+                )
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            get_object_or_404(self.queryset, id=obj_id)
         return Response(status=status.HTTP_400_BAD_REQUEST)
+
+    def add_del_batch(self, manager):
+        """Добавляет (POST) или удаляет (DELETE) связи с объектами `ids`.
+
+        Объекты и уже существующие связи читаются одним запросом, изменения
+        пишутся одним `INSERT` или `DELETE`; сигналы и счётчики получают
+        только строки, которые этот запрос действительно изменил. Для
+        каждого id возвращается статус: `added`/`exists` или
+        `removed`/`absent`, `not_found` - если объекта нет.
+        """
+        user = self.request.user
+        if user.is_anonymous:
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        serializer = BatchIdsSerializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+
+        through = manager.through
+        db = router.db_for_write(through, instance=manager.instance)
+        source = f'{manager.source_field_name}_id'
+        target = f'{manager.target_field_name}_id'
+        owner = manager.instance.pk
+        links = through._default_manager.using(db).filter(**{source: owner})
+        linked = dict(
+            self.queryset.filter(id__in=ids).annotate(
+                linked=Exists(links.filter(**{target: OuterRef('pk')}))
+            ).order_by().values_list('id', 'linked')
+        )
+        adding = self.request.method == 'POST'
+        changed = {
+            pk for pk, is_linked in linked.items() if is_linked != adding
+        }
+        if changed:
+            with transaction.atomic(using=db):
+                changed = change_links(manager, changed, adding)
+                if changed:
+                    send_m2m_changed(
+                        manager, 'post_add' if adding else 'post_remove',
+                        changed, db,
+                    )
+                    self.relation_changed(manager, changed, added=adding)
+        if changed:
+            get_relations(self.request).changed(
+                manager.prefetch_cache_name, changed, added=adding
+            )
+
+        done, unchanged = ('added', 'exists') if adding else (
+            'removed', 'absent'
+        )
+        return Response([
+            {
+                'id': pk,
+                'status': (
+                    'not_found' if pk not in linked
+                    else done if pk in changed
+                    else unchanged
+                ),
+            }
+            for pk in ids
+        ])
+
+
+class AnonymousCacheMixin:
+    """Кеширует ответы `list`/`retrieve` для анонимных пользователей.
+
+    Ключ состоит из нормализованной строки запроса и поколений из
+    `get_cache_generations`; сигналы сдвигают поколения, и старые записи
+    просто перестают читаться.
+    """
+
+    cache_alias = settings.RECIPE_CACHE_ALIAS
+    cache_prefix = None
+
+    def get_cache_generations(self):
+        return ()
+
+    def get_cache_key(self, request):
+        query = sorted(
+            (key, value)
+            for key, values in request.query_params.lists()
+            for value in values
+        )
+        generations = ':'.join(
+            map(str, get_versions(self.get_cache_generations()).values())
+        )
+        digest = hashlib.md5(
+            f'{request.path}?{query}'.encode()
+        ).hexdigest()
+        return f'{self.cache_prefix}:{self.action}:{generations}:{digest}'
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not request.user.is_anonymous:
+            return handler(request, *args, **kwargs)
+        cache = caches[self.cache_alias]
+        key = self.get_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
@@ -1,6 +1,147 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Пагинация по ключу без `COUNT(*)` и `OFFSET`.
+
+    Порядок задаётся атрибутом вьюсета `keyset_ordering`, последним полем
+    должен быть уникальный ключ. Курсор - закодированные значения этих
+    полей у последней (или первой) записи страницы.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = 6
+    max_page_size = settings.MAX_PAGE_SIZE
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = getattr(view, 'keyset_ordering', ('-id',))
+        position, reverse = self.decode_cursor(request, queryset.model)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(self.invert(field) for field in ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(ordering, position))
+        page = list(queryset[:self.page_size + 1])
+        has_more = len(page) > self.page_size
+        page = page[:self.page_size]
+        if reverse:
+            page.reverse()
+
+        self.next_position = self.previous_position = None
+        if page and (reverse or has_more):
+            self.next_position = self.position_of(page[-1])
+        if page and (has_more if reverse else position is not None):
+            self.previous_position = self.position_of(page[0])
+        return page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict((
+            ('next', self.build_link(self.next_position, reverse=False)),
+            ('previous', self.build_link(self.previous_position, True)),
+            ('results', data),
+        )))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def after(ordering, position):
+        """Условие "строго после `position`" в заданном порядке."""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def position_of(self, obj):
+        return [
+            obj._meta.get_field(field.lstrip('-')).value_to_string(obj)
+            for field in self.ordering
+        ]
+
+    def decode_cursor(self, request, model):
+        """Позиция и направление из курсора; значения приводятся к типам
+        полей `keyset_ordering`, испорченный курсор - 404."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            position, reverse = cursor['p'], bool(cursor.get('r'))
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or (
+            len(position) != len(self.ordering)
+        ) or None in position:
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            position = [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, position)
+            ]
+        except (ValidationError, TypeError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def build_link(self, position, reverse):
+        if position is None:
+            return None
+        cursor = {'p': position}
+        if reverse:
+            cursor['r'] = 1
+        encoded = base64.urlsafe_b64encode(
+            json.dumps(cursor, separators=(',', ':')).encode()
+        ).decode()
+        url = remove_query_param(self.request.build_absolute_uri(), 'page')
+        return replace_query_param(url, self.cursor_query_param, encoded)
 
 
 class StandardResultsSetPagination(PageNumberPagination):
+    """Постраничная пагинация; с параметром `cursor` - по ключу."""
+
     page_size_query_param = 'limit'
     page_size = 6
+    max_page_size = settings.MAX_PAGE_SIZE
+    keyset_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.keyset_class.cursor_query_param in request.query_params:
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
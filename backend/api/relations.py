@@ -0,0 +1,54 @@
+from recipes.models import Recipe
+from users.models import User
+
+# Имя менеджера у пользователя: (таблица связи, поле пользователя, поле id).
+RELATIONS = {
+    'subscribe': (User.subscribe.through, 'from_user_id', 'to_user_id'),
+    'favorites': (Recipe.favorite.through, 'user_id', 'recipe_id'),
+    'carts': (Recipe.cart.through, 'user_id', 'recipe_id'),
+}
+
+
+class UserRelations:
+    """Id подписок, избранного и списка покупок текущего пользователя.
+
+    Каждое множество читается одним запросом к таблице связи при первом
+    обращении и живёт до конца запроса.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._ids = {}
+
+    def ids(self, name):
+        if self.user.is_anonymous:
+            return frozenset()
+        if name not in self._ids:
+            through, user_field, id_field = RELATIONS[name]
+            self._ids[name] = frozenset(
+                through.objects.filter(
+                    **{user_field: self.user.id}
+                ).values_list(id_field, flat=True)
+            )
+        return self._ids[name]
+
+    def contains(self, name, pk):
+        return pk in self.ids(name)
+
+    def changed(self, name, pks, added):
+        """Учитывает связи, добавленные или удалённые в этом запросе."""
+        if name not in self._ids:
+            return
+        if added:
+            self._ids[name] = self._ids[name] | set(pks)
+        else:
+            self._ids[name] = self._ids[name] - set(pks)
+
+
+def get_relations(request):
+    """`UserRelations` запроса, общий для всех сериализаторов."""
+    relations = getattr(request, '_user_relations', None)
+    if relations is None or relations.user is not request.user:
+        relations = UserRelations(request.user)
+        request._user_relations = relations
+    return relations
@@ -0,0 +1,40 @@
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSON через orjson, без него - обычный `JSONRenderer` DRF.
+
+    Даты, `Decimal`, ленивые строки и прочее, чего orjson не знает,
+    кодируются так же, как в DRF. Ответы с отступами (`indent` в
+    `Accept`) рендерятся стандартным способом.
+    """
+
+    encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(
+            accepted_media_type, renderer_context or {}
+        ):
+            return super().render(
+                data, accepted_media_type, renderer_context
+            )
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder.default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME,
+            )
+        except TypeError:
+            return super().render(
+                data, accepted_media_type, renderer_context
+            )
+        # Как в DRF: U+2028 и U+2029 недопустимы в строках JavaScript.
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(
+            b'\xe2\x80\xa9', b'\\u2029'
+        )
@@ -1,24 +1,90 @@
+from collections import OrderedDict
+
 from django.conf import settings
+from django.db import transaction
 from django.db.models import F
-from django.shortcuts import get_object_or_404
-from drf_extra_fields.fields import Base64ImageField
-from rest_framework import serializers
-
-from recipes.models import AmountIngredient, Ingredient, Recipe, Tag
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
+from rest_framework.permissions import SAFE_METHODS
+
+from .fields import RecipeImageField
+from .relations import get_relations
+from recipes.models import (AmountIngredient, ImageUpload, Ingredient, Recipe,
+                            ShoppingCartTotal, Tag)
 from users.models import User
 from users.validators import username_validator
 
 
+def requested_fields(request, available):
+    """Поля ответа по параметрам `fields` и `omit` запроса.
+
+    `None` - если ответ полный или запрос не на чтение. Неизвестные имена
+    дают 400.
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    params = request.query_params
+    only, omit = (
+        {
+            name.strip()
+            for name in ','.join(params.getlist(param)).split(',')
+            if name.strip()
+        }
+        for param in ('fields', 'omit')
+    )
+    if not only and not omit:
+        return None
+    unknown = (only | omit) - set(available)
+    if unknown:
+        raise serializers.ValidationError({
+            'fields': f'Неизвестные поля: {", ".join(sorted(unknown))}.'
+        })
+    return (only or set(available)) - omit
+
+
+class SparseFieldsMixin:
+    """Оставляет в ответе только поля из `fields`/`omit` запроса.
+
+    Действует на сериализатор верхнего уровня (и элементы списка), вложенные
+    сериализаторы отдаются целиком.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        if parent is not None:
+            return fields
+        keep = requested_fields(
+            self.context.get('request'),
+            [name for name, field in fields.items() if not field.write_only],
+        )
+        if keep is None:
+            return fields
+        return OrderedDict(
+            (name, field) for name, field in fields.items() if name in keep
+        )
+
+
+class VersionConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Рецепт уже изменён, обновите страницу.'
+    default_code = 'conflict'
+
+
 class ShortRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для модели Recipe."""
 
+    image = RecipeImageField(read_only=True, variant='thumb')
+
     class Meta:
         model = Recipe
         fields = 'id', 'name', 'image', 'cooking_time'
         read_only_fields = '__all__',
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Сериализатор для использования с моделью User."""
 
     is_subscribed = serializers.SerializerMethodField()
@@ -40,10 +106,12 @@ class UserSerializer(serializers.ModelSerializer):
     def get_is_subscribed(self, obj):
         """Проверка подписки пользователей."""
 
-        user = self.context.get('request').user
-        if user.is_anonymous or user == obj:
+        request = self.context.get('request')
+        if request.user.is_anonymous or request.user == obj:
             return False
-        return user.subscribe.filter(id=obj.id).exists()
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return get_relations(request).contains('subscribe', obj.id)
 
     def create(self, validated_data):
         """ Создаёт нового пользователя с запрошенными полями."""
@@ -68,7 +136,7 @@ class UserSubscribeSerializer(UserSerializer):
     """Сериализатор создания связи подписки/избранного/шопинг карты."""
 
     recipes = ShortRecipeSerializer(many=True, read_only=True)
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = User
@@ -83,19 +151,13 @@ class UserSubscribeSerializer(UserSerializer):
             'recipes_count',
         )
         read_only_fields = '__all__',
-    
-    def get_recipes_count(self, obj):
-        """ Показывает общее количество рецептов у каждого автора."""
-
-        return obj.recipes.count()
 
 
 class SubscribeListSerializer(UserSerializer):
     "Сериализатор вывода авторов на которых подписан текущий пользователь."
 
-    is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = User
@@ -111,32 +173,21 @@ class SubscribeListSerializer(UserSerializer):
         )
         read_only_fields = '__all__',
 
-    def get_is_subscribed(self, obj):
-        """Проверка подписки пользователей."""
-
-        user = self.context.get('request').user
-        if user.is_anonymous or user == obj:
-            return False
-        return user.subscribe.filter(id=obj.id).exists()
-
     def get_recipes(self, obj):
         """Показывает рецепты избранного автора."""
 
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
-        recipes = Recipe.objects.filter(author=obj)
-        limit = request.query_params.get('recipes_limit')
-        if limit:
-            recipes = recipes[:int(limit)]
+        if hasattr(obj, 'latest_recipes'):
+            recipes = obj.latest_recipes
+        else:
+            recipes = Recipe.objects.filter(author=obj)[:self.context.get(
+                'recipes_limit', settings.MAX_RECIPES_LIMIT
+            )]
         return ShortRecipeSerializer(
             recipes, many=True, context={'request': request}).data
 
-    def get_recipes_count(self, obj):
-        """ Показывает общее количество рецептов у каждого автора."""
-
-        return obj.recipes.count()
-
 
 class TokenSerializer(serializers.Serializer):
     """Сериалазер без модели, для полей email и password."""
@@ -147,6 +198,19 @@ class TokenSerializer(serializers.Serializer):
         max_length=settings.PASSWORD_LENGTH, required=True)
 
 
+class BatchIdsSerializer(serializers.Serializer):
+    """Список id для пакетного добавления/удаления связей."""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.MAX_BATCH_LINKS,
+    )
+
+    def validate_ids(self, value):
+        return list(dict.fromkeys(value))
+
+
 class TagSerializer(serializers.ModelSerializer):
     """Сериалазер для модели Tag."""
 
@@ -172,11 +236,11 @@ class IngredientSerializer(serializers.ModelSerializer):
         )
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     ingredients = serializers.SerializerMethodField()
     tags = TagSerializer(many=True)
-    image = Base64ImageField()
+    image = RecipeImageField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
@@ -192,45 +256,67 @@ class RecipeSerializer(serializers.ModelSerializer):
             'name',
             'image',
             'text',
-            'cooking_time'
+            'cooking_time',
+            'version',
         )
 
+    def to_representation(self, instance):
+        if hasattr(instance, 'author_is_subscribed'):
+            instance.author.is_subscribed = instance.author_is_subscribed
+        return super().to_representation(instance)
+
     def get_ingredients(self, obj):
         """Получает список ингридиентов для рецепта."""
 
-        return obj.ingredients.values(
-            'id',
-            'name',
-            'measurement_unit',
-            amount=F('recipe__amount')
-        )
+        if 'ingredient' not in getattr(obj, '_prefetched_objects_cache', {}):
+            return obj.ingredients.values(
+                'id',
+                'name',
+                'measurement_unit',
+                amount=F('recipe__amount')
+            )
+        return [
+            {
+                'id': amount.ingredients.id,
+                'name': amount.ingredients.name,
+                'measurement_unit': amount.ingredients.measurement_unit,
+                'amount': amount.amount,
+            }
+            for amount in obj.ingredient.all()
+        ]
 
     def get_is_favorited(self, obj):
         """Проверка - находится ли рецепт в избранном."""
 
-        user = self.context.get('request').user
-        if user.is_anonymous:
+        request = self.context.get('request')
+        if request.user.is_anonymous:
             return False
-        return user.favorites.filter(id=obj.id).exists()
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
+        return get_relations(request).contains('favorites', obj.id)
 
     def get_is_in_shopping_cart(self, obj):
         """Проверка - находится ли рецепт в списке  покупок."""
 
-        user = self.context.get('request').user
-        if user.is_anonymous:
+        request = self.context.get('request')
+        if request.user.is_anonymous:
             return False
-        return user.carts.filter(id=obj.id).exists()
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+        return get_relations(request).contains('carts', obj.id)
 
 
 class RecipesCreateSerializer(serializers.ModelSerializer):
     """ Сериализатор для создания и редактирования рецептов."""
 
     author = UserSerializer(read_only=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(), many=True
-    )
-    image = Base64ImageField()
+    tags = serializers.ListField(child=serializers.IntegerField())
+    image = RecipeImageField(required=False)
+    image_token = serializers.CharField(write_only=True, required=False)
     ingredients = serializers.ListField()
+    version = serializers.IntegerField(
+        write_only=True, required=False, min_value=1
+    )
 
     class Meta:
         model = Recipe
@@ -241,58 +327,179 @@ class RecipesCreateSerializer(serializers.ModelSerializer):
             'ingredients',
             'name',
             'image',
+            'image_token',
             'text',
-            'cooking_time'
+            'cooking_time',
+            'version',
         )
 
     def create_amount_ingredients(self, ingredients, recipe):
         """Обновляет ингридиенты в рецепте."""
 
-        create_ingredient = [
+        AmountIngredient.objects.bulk_create(
             AmountIngredient(
                 recipe=recipe,
-                ingredients=get_object_or_404(Ingredient, pk=ingredient["id"]),
+                ingredients_id=ingredient['id'],
                 amount=ingredient['amount']
             )
-            for ingredient in ingredients]
-        AmountIngredient.objects.bulk_create(create_ingredient)
+            for ingredient in ingredients
+        )
 
+    @transaction.atomic
     def create(self, validated_data):
         """Создаёт рецепт."""
 
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
+        upload = validated_data.pop('image_upload', None)
+        validated_data.pop('version', None)
         recipe = Recipe.objects.create(**validated_data)
-        recipe.tags.set(tags)
+        recipe.tags.add(*tags)
         self.create_amount_ingredients(ingredients, recipe)
+        if upload is not None:
+            upload.delete()
         return recipe
 
+    def bump_version(self, obj, expected):
+        """Увеличивает версию рецепта; при чужой правке - 409.
+
+        UPDATE берёт блокировку строки, поэтому параллельные правки
+        одного рецепта выполняются по очереди.
+        """
+
+        recipes = Recipe.objects.filter(pk=obj.pk)
+        if expected is not None:
+            recipes = recipes.filter(version=expected)
+        if not recipes.update(version=F('version') + 1):
+            raise VersionConflict()
+        if expected is None:
+            obj.refresh_from_db(fields=('version',))
+        else:
+            obj.version = expected + 1
+
+    def update_amount_ingredients(self, obj, ingredients):
+        """Меняет только изменившиеся количества ингредиентов."""
+
+        stored = {
+            ingredient_id: (pk, amount)
+            for pk, ingredient_id, amount in obj.ingredient.values_list(
+                'id', 'ingredients_id', 'amount'
+            )
+        }
+        submitted = {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients
+        }
+        removed = [
+            pk for ingredient_id, (pk, _) in stored.items()
+            if ingredient_id not in submitted
+        ]
+        changed = [
+            AmountIngredient(pk=stored[ingredient_id][0], amount=amount)
+            for ingredient_id, amount in submitted.items()
+            if ingredient_id in stored and stored[ingredient_id][1] != amount
+        ]
+        added = [
+            ingredient for ingredient in ingredients
+            if ingredient['id'] not in stored
+        ]
+        if removed:
+            # Одним DELETE без сигналов post_delete: итоги списков покупок
+            # меняются ниже одним вызовом вместе с остальными строками.
+            removed = AmountIngredient.objects.filter(pk__in=removed)
+            removed._raw_delete(removed.db)
+        if changed:
+            AmountIngredient.objects.bulk_update(changed, ('amount',))
+        if added:
+            self.create_amount_ingredients(added, obj)
+        if removed or changed or added:
+            ShoppingCartTotal.objects.change_recipe(
+                obj,
+                {
+                    ingredient_id: amount
+                    for ingredient_id, (_, amount) in stored.items()
+                },
+                submitted,
+            )
+
+    @transaction.atomic
     def update(self, obj, validated_data):
         """Обновляет рецепт."""
 
+        self.bump_version(obj, validated_data.pop('version', None))
+        upload = validated_data.pop('image_upload', None)
+        if upload is not None:
+            upload.delete()
         if 'ingredients' in validated_data:
-            ingredients = validated_data.pop('ingredients')
-            obj.ingredients.clear()
-            self.create_amount_ingredients(ingredients, obj)
+            self.update_amount_ingredients(
+                obj, validated_data.pop('ingredients')
+            )
         if 'tags' in validated_data:
-            tags = validated_data.pop('tags')
-            obj.tags.set(tags)
+            obj.tags.set(validated_data.pop('tags'))
         return super().update(obj, validated_data)
 
+    def validate_image_token(self, value):
+        """Токен должен принадлежать автору запроса."""
+
+        upload = ImageUpload.objects.filter(
+            token=value, user=self.context['request'].user
+        ).first()
+        if upload is None:
+            raise serializers.ValidationError('Загрузка не найдена.')
+        return upload
+
     def validate(self, data):
-        ingredients = data['ingredients']
-        unique_ings = []
+        upload = data.pop('image_token', None)
+        if upload is not None:
+            data['image'] = upload.image.name
+            data['image_upload'] = upload
+        elif self.instance is None and not data.get('image'):
+            raise serializers.ValidationError(
+                {'image': 'Передайте изображение или image_token.'}
+            )
+        return data
+
+    def validate_tags(self, tags):
+        """Проверяет все теги одним запросом."""
+
+        if len(set(tags)) != len(tags):
+            raise serializers.ValidationError('Теги повторяются!')
+        found = Tag.objects.in_bulk(tags)
+        missing = [tag for tag in tags if tag not in found]
+        if missing:
+            raise serializers.ValidationError(
+                f'Теги не найдены: {", ".join(map(str, missing))}'
+            )
+        return [found[tag] for tag in tags]
+
+    def validate_ingredients(self, ingredients):
+        """Проверяет ингредиенты и их наличие в базе одним запросом."""
+
+        cleaned = []
+        seen = set()
         for ingredient in ingredients:
-            name = ingredient['id']
-            if int(ingredient['amount']) <= 0:
+            try:
+                pk = int(ingredient['id'])
+                amount = int(ingredient['amount'])
+            except (KeyError, TypeError, ValueError):
+                raise serializers.ValidationError(
+                    'Ожидается список объектов с полями id и amount.'
+                )
+            if amount <= 0:
                 raise serializers.ValidationError(
-                    f'Не корректное количество для {name}'
+                    f'Не корректное количество для {pk}'
                 )
-            if name not in unique_ings:
-                unique_ings.append(name)
-            else:
+            if pk in seen:
                 raise serializers.ValidationError('Ингредиенты повторяются!')
-        return data
+            seen.add(pk)
+            cleaned.append({'id': pk, 'amount': amount})
+        found = Ingredient.objects.in_bulk(seen)
+        missing = [item['id'] for item in cleaned if item['id'] not in found]
+        if missing:
+            raise serializers.ValidationError(
+                f'Ингредиенты не найдены: {", ".join(map(str, missing))}'
+            )
+        return cleaned
 
     def to_representation(self, instance):
         return RecipeSerializer(
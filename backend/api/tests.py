@@ -0,0 +1,134 @@
+import base64
+import json
+import shutil
+import tempfile
+
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import User
+
+MEDIA_ROOT = tempfile.mkdtemp()
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=='
+)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RecipeCreateQueriesTest(APITestCase):
+    """Число запросов при создании рецепта не зависит от состава."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='author', email='author@example.com',
+            first_name='Имя', last_name='Фамилия',
+        )
+        cls.tag = Tag.objects.create(
+            name='Обед', color='#00ff00', slug='dinner'
+        )
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {i:02}', measurement_unit='г')
+            for i in range(50)
+        )
+        cls.ingredients = list(Ingredient.objects.order_by('name'))
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def create_recipe(self, size):
+        """Создаёт рецепт из `size` ингредиентов, возвращает число
+        запросов."""
+        data = {
+            'name': f'Рецепт {size}',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': IMAGE,
+            'tags': [self.tag.pk],
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': 5}
+                for ingredient in self.ingredients[:size]
+            ],
+        }
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/recipes/', data, format='json')
+        self.assertEqual(
+            response.status_code, status.HTTP_201_CREATED, response.data
+        )
+        recipe = Recipe.objects.get(pk=response.data['id'])
+        self.assertEqual(recipe.ingredient.count(), size)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_ingredients(self):
+        self.assertEqual(self.create_recipe(5), self.create_recipe(50))
+
+    def test_missing_ingredients_reported_together(self):
+        response = self.client.post('/api/recipes/', {
+            'name': 'Рецепт',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': IMAGE,
+            'tags': [self.tag.pk],
+            'ingredients': [
+                {'id': self.ingredients[0].pk, 'amount': 5},
+                {'id': 100001, 'amount': 5},
+                {'id': 100002, 'amount': 5},
+            ],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('100001', str(response.data))
+        self.assertIn('100002', str(response.data))
+        self.assertFalse(Recipe.objects.exists())
+
+
+class KeysetCursorTest(APITestCase):
+    """Курсор пагинации по ключу."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='author', email='author@example.com',
+            first_name='Имя', last_name='Фамилия',
+        )
+        for i in range(3):
+            Recipe.objects.create(
+                author=cls.user, name=f'Рецепт {i}', text='Описание',
+                cooking_time=10, image='recipes/images/recipe.png',
+            )
+
+    @staticmethod
+    def encode(cursor):
+        return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+    def test_next_link(self):
+        response = self.client.get('/api/recipes/', {'cursor': '', 'limit': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_malformed_cursor(self):
+        self.client.force_authenticate(self.user)
+        for url, cursor in (
+            ('/api/recipes/', self.encode({'p': ['garbage', 'x']})),
+            ('/api/recipes/', self.encode({'p': [None, 1]})),
+            ('/api/recipes/', self.encode({'p': [[1], {'a': 1}]})),
+            ('/api/recipes/', 'не base64'),
+            ('/api/users/', self.encode({'p': ['author', 'x']})),
+            ('/api/recipes/feed/', self.encode({'p': ['garbage', 1]})),
+        ):
+            with self.subTest(url=url, cursor=cursor):
+                response = self.client.get(url, {'cursor': cursor})
+                self.assertEqual(
+                    response.status_code, status.HTTP_404_NOT_FOUND
+                )
@@ -17,6 +17,7 @@ auth_urls = [
 ]
 
 urlpatterns = (
+    path('uploads/', views.upload_image, name='upload'),
     path('', include(router_v1.urls)),
     path('', include(auth_urls))
 )
@@ -1,20 +1,31 @@
 from django.conf import settings
 from django.contrib.auth.hashers import check_password
-from django.db.models import F, Sum
-from django.http.response import HttpResponse
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import transaction
+from django.db.models import BooleanField, F, Value
+from django.http.response import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet as DjoserUserViewSet
 from rest_framework import mixins
 from rest_framework import permissions as drf_permissions
 from rest_framework import status, viewsets
 from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 
 from . import paginators, permissions, serializers
-from .filters import IngredientSearchFilterSet, RecipeFilters
-from .mixins import AddDelViewMixin
-from recipes import models
+from .exporters import EXPORTERS
+from .filters import RecipeFilters
+from .mixins import (AddDelViewMixin, AnonymousCacheMixin,
+                     ConditionalGetMixin, choose_encoding, make_etag)
+from recipes import counters, models, trigrams
+from recipes.images import check_upload_size, store_upload
+from recipes.ingredient_index import get_ingredient_index
+from recipes.validators import check_value_validate
+from recipes.versions import (get_last_modified, get_modified,
+                              get_versions)
 from users.models import User
 
 
@@ -22,6 +33,7 @@ class UserViewSet(DjoserUserViewSet, AddDelViewMixin):
     """Кастомный вьюсет Djoser."""
 
     pagination_class = paginators.StandardResultsSetPagination
+    keyset_ordering = ('username', 'id')
     add_serializer = serializers.UserSubscribeSerializer
 
     @action(methods=settings.ACTION_METHODS, detail=True)
@@ -30,15 +42,49 @@ class UserViewSet(DjoserUserViewSet, AddDelViewMixin):
 
         return self.add_del_obj(pk, request.user.subscribe)
 
+    @action(methods=settings.BATCH_ACTION_METHODS, detail=False,
+            url_path='subscribe')
+    def subscribe_batch(self, request):
+        """Создаёт/удаляет подписки на авторов из списка `ids`."""
+
+        return self.add_del_batch(request.user.subscribe)
+
+    def get_recipes_limit(self):
+        """Проверяет `recipes_limit` и ограничивает его сверху."""
+
+        limit = self.request.query_params.get('recipes_limit')
+        if limit is None:
+            return settings.MAX_RECIPES_LIMIT
+        limit = int(check_value_validate(limit))
+        if limit < 1:
+            raise ValidationError(
+                {'recipes_limit': 'Значение должно быть больше нуля.'}
+            )
+        return min(limit, settings.MAX_RECIPES_LIMIT)
+
     @action(methods=('get',), detail=False)
     def subscriptions(self, request):
         """Список подписок пользоваетеля."""
 
         user = self.request.user
-        authors = user.subscribe.all()
+        recipes_limit = self.get_recipes_limit()
+        authors = user.subscribe.annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+        )
         pages = self.paginate_queryset(authors)
+        fields = serializers.requested_fields(
+            request, serializers.SubscribeListSerializer.Meta.fields
+        )
+        if fields is None or 'recipes' in fields:
+            latest_recipes = models.Recipe.objects.latest_by_author(
+                [author.id for author in pages], recipes_limit
+            )
+            for author in pages:
+                author.latest_recipes = latest_recipes[author.id]
         serializer = serializers.SubscribeListSerializer(
-            pages, many=True, context={'request': request}
+            pages,
+            many=True,
+            context={'request': request, 'recipes_limit': recipes_limit},
         )
         return self.get_paginated_response(serializer.data)
 
@@ -79,15 +125,53 @@ def delete_token(request):
     )
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+@api_view(['POST'])
+@permission_classes([drf_permissions.IsAuthenticated])
+def upload_image(request):
+    """Потоковая загрузка изображения рецепта.
+
+    Принимает multipart-поле `file` или сырое тело с `Content-Type: image/*`
+    и возвращает токен для поля `image_token` рецепта. Тело читается
+    кусками по `UPLOAD_CHUNK_SIZE`, целиком в память не попадает.
+    """
+
+    django_request = request._request
+    chunk_size = settings.UPLOAD_CHUNK_SIZE
+    if request.content_type.startswith('multipart/form-data'):
+        django_request.upload_handlers = [
+            TemporaryFileUploadHandler(django_request)
+        ]
+        source = django_request.FILES.get('file')
+        if source is None:
+            raise ValidationError({'file': 'Файл не передан.'})
+        chunks = source.chunks(chunk_size)
+    elif request.content_type.startswith('image/'):
+        length = django_request.META.get('CONTENT_LENGTH') or 0
+        check_upload_size(int(check_value_validate(length)))
+        chunks = iter(lambda: django_request.read(chunk_size), b'')
+    else:
+        return Response(
+            {'detail': 'Ожидается multipart/form-data или image/*.'},
+            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+        )
+    upload = store_upload(request.user, chunks)
+    return Response(
+        {'image_token': upload.token, 'image': upload.image.url},
+        status=status.HTTP_201_CREATED,
+    )
+
+
+class TagViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """Вьюсет для тэгов."""
 
     queryset = models.Tag.objects.all()
     serializer_class = serializers.TagSerializer
     pagination_class = None
+    version_name = 'tags'
 
 
-class IngredientViewSet(mixins.ListModelMixin,
+class IngredientViewSet(ConditionalGetMixin,
+                        mixins.ListModelMixin,
                         mixins.RetrieveModelMixin,
                         viewsets.GenericViewSet):
     """Работет с игридиентами."""
@@ -95,19 +179,149 @@ class IngredientViewSet(mixins.ListModelMixin,
     queryset = models.Ingredient.objects.all()
     serializer_class = serializers.IngredientSerializer
     pagination_class = None
-    filter_backends = [IngredientSearchFilterSet, ]
-    search_fields = ['^name', ]
+    version_name = 'ingredients'
 
+    def is_catalog_request(self, request):
+        """Весь справочник: без `name`, `search` и `limit`."""
 
-class RecipeViewSet(viewsets.ModelViewSet, AddDelViewMixin):
+        params = request.query_params
+        return (
+            self.action == 'list'
+            and not params.get('name')
+            and 'search' not in params
+            and 'limit' not in params
+        )
+
+    def get_validators(self, request):
+        """Для всего справочника - сильный ETag его тела в выбранном
+        сжатии."""
+
+        if not self.is_catalog_request(request):
+            return super().get_validators(request)
+        catalog = get_ingredient_index().catalog
+        encoding = choose_encoding(request, catalog.bodies)
+        return (
+            make_etag(catalog.digest, encoding),
+            get_modified(self.version_name),
+        )
+
+    def list(self, request, *args, **kwargs):
+        """Поиск по префиксу названия через индекс в памяти процесса.
+
+        С параметром `search` - нечёткий поиск по триграммам. Весь
+        справочник отдаётся готовым телом, сжатым заранее.
+        """
+
+        if self.is_catalog_request(request):
+            return self.catalog_response(request)
+        limit = request.query_params.get('limit')
+        if limit is not None:
+            limit = int(check_value_validate(limit))
+        if 'search' in request.query_params:
+            return self.fuzzy_list(request.query_params['search'], limit)
+        return Response(get_ingredient_index().search(
+            request.query_params.get('name', ''), limit
+        ))
+
+    def catalog_response(self, request):
+        catalog = get_ingredient_index().catalog
+        encoding = choose_encoding(request, catalog.bodies)
+        response = HttpResponse(
+            catalog.bodies[encoding], content_type='application/json'
+        )
+        if encoding != 'identity':
+            response['Content-Encoding'] = encoding
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+    def fuzzy_list(self, query, limit):
+        matches = trigrams.search(
+            models.TrigramEntry.INGREDIENT, query, limit
+        )
+        ingredients = models.Ingredient.objects.in_bulk(
+            [object_id for object_id, _ in matches]
+        )
+        return Response(self.get_serializer(
+            [
+                ingredients[object_id] for object_id, _ in matches
+                if object_id in ingredients
+            ],
+            many=True,
+        ).data)
+
+
+class RecipeViewSet(ConditionalGetMixin, AnonymousCacheMixin,
+                    viewsets.ModelViewSet, AddDelViewMixin):
     """Работает с рецептами."""
 
     queryset = models.Recipe.objects.all()
     permission_classes = (permissions.AdminAuthorsReadOnly,)
     pagination_class = paginators.StandardResultsSetPagination
+    keyset_ordering = ('-pub_date', '-id')
     add_serializer = serializers.ShortRecipeSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilters
+    cache_prefix = 'recipes'
+
+    def get_cache_generations(self):
+        if self.action == 'list':
+            return 'recipes', 'recipe_list'
+        return 'recipes', f'recipe:{self.kwargs[self.lookup_field]}'
+
+    def get_queryset(self):
+        """Рецепты со всем, что нужно сериализатору, без запросов на строку.
+
+        Связи и флаги полей, исключённых через `fields`/`omit`, не читаются.
+        """
+
+        fields = serializers.requested_fields(
+            self.request, serializers.RecipeSerializer.Meta.fields
+        )
+        recipes = self.queryset.with_related(fields).with_user_flags(
+            self.request.user, fields
+        )
+        if fields is not None and 'text' not in fields:
+            recipes = recipes.defer('text')
+        return recipes
+
+    def get_validators(self, request):
+        """Валидаторы рецепта: дата изменения, автор, версии тегов и
+        ингредиентов и отметки пользователя. Last-Modified только для
+        анонимов, у остальных отметки меняются независимо от рецепта."""
+
+        if self.action != 'retrieve':
+            return None, None
+        recipes = self.queryset.with_user_flags(request.user)
+        try:
+            state = recipes.filter(pk=self.kwargs[self.lookup_field]).values(
+                'id',
+                'updated_at',
+                'author__email',
+                'author__username',
+                'author__first_name',
+                'author__last_name',
+                *recipes.query.annotations,
+            ).first()
+        except (TypeError, ValueError):
+            return None, None
+        if state is None:
+            return None, None
+        nested = ('tags', 'ingredients')
+        etag = make_etag(*state.values(), *get_versions(nested).values())
+        if request.user.is_authenticated:
+            return etag, None
+        return etag, max(
+            int(state['updated_at'].timestamp()),
+            get_last_modified(nested) or 0,
+        )
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        if self.etag:
+            patch_vary_headers(response, ('Authorization',))
+        return response
 
     def get_serializer_class(self):
         """Выбор сериализатора в зависимости от запроса."""
@@ -116,8 +330,9 @@ class RecipeViewSet(viewsets.ModelViewSet, AddDelViewMixin):
             return serializers.RecipeSerializer
         return serializers.RecipesCreateSerializer
 
+    @transaction.atomic
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        counters.recipe_published(serializer.save(author=self.request.user))
 
     @action(methods=(settings.ACTION_METHODS), detail=True)
     def favorite(self, request, pk=None):
@@ -131,34 +346,89 @@ class RecipeViewSet(viewsets.ModelViewSet, AddDelViewMixin):
 
         return self.add_del_obj(pk, request.user.carts)
 
+    @action(methods=settings.BATCH_ACTION_METHODS, detail=False,
+            url_path='favorite')
+    def favorite_batch(self, request):
+        """Добавляет/удаляет в избранное рецепты из списка `ids`."""
+
+        return self.add_del_batch(request.user.favorites)
+
+    @action(methods=settings.BATCH_ACTION_METHODS, detail=False,
+            url_path='shopping_cart')
+    def shopping_cart_batch(self, request):
+        """Добавляет/удаляет в список покупок рецепты из списка `ids`."""
+
+        return self.add_del_batch(request.user.carts)
+
+    @action(methods=('get',), detail=False)
+    def trending(self, request):
+        """Рецепты по убыванию рейтинга с затуханием по времени."""
+
+        self.keyset_ordering = ('-trending_score', '-id')
+        recipes = self.filter_queryset(self.get_queryset()).order_by(
+            *self.keyset_ordering
+        )
+        page = self.paginate_queryset(recipes)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        methods=('get',),
+        detail=False,
+        permission_classes=(drf_permissions.IsAuthenticated,),
+    )
+    def feed(self, request):
+        """Лента рецептов авторов из подписок.
+
+        Страница читается из `FeedEntry` одним проходом по индексу
+        `(user, -pub_date, -recipe)`, пагинация только по курсору.
+        """
+
+        self.keyset_ordering = ('-pub_date', '-recipe_id')
+        paginator = paginators.KeysetPagination()
+        entries = paginator.paginate_queryset(
+            request.user.feed_entries.only('user_id', 'pub_date', 'recipe_id'),
+            request,
+            self,
+        )
+        recipes = self.get_queryset().in_bulk(
+            [entry.recipe_id for entry in entries]
+        )
+        serializer = serializers.RecipeSerializer(
+            [
+                recipes[entry.recipe_id] for entry in entries
+                if entry.recipe_id in recipes
+            ],
+            many=True,
+            context=self.get_serializer_context(),
+        )
+        return paginator.get_paginated_response(serializer.data)
+
     @action(methods=('get',), detail=False)
     def download_shopping_cart(self, request):
-        """Загружает файл *.txt со списком покупок."""
+        """Загружает файл со списком покупок в формате `file_format`."""
 
         user = self.request.user
+        exporter_class = EXPORTERS.get(
+            request.query_params.get('file_format', 'txt')
+        )
+        if exporter_class is None:
+            raise ValidationError(
+                {'file_format': f'Доступные форматы: {", ".join(EXPORTERS)}.'}
+            )
         if not user.carts.exists():
             return Response(status=status.HTTP_400_BAD_REQUEST)
-        ingredients = models.AmountIngredient.objects.filter(
-            recipe__in=(user.carts.values('id'))
-        ).values(
-            ingredient=F('ingredients__name'),
-            measure=F('ingredients__measurement_unit')
-        ).annotate(ingredients_value=Sum('amount'))
-
-        filename = f'{user.username}_shopping_list.txt'
-        shopping_list = (
-            f'Список покупок для: {user.first_name}\n'
-        )
-
-        for ing in ingredients:
-            shopping_list += (
-                f'{ing["ingredient"]}: {ing["ingredients_value"]}'
-                f'{ing["measure"]}\n'
-            )
-
-        shopping_list += '\nПосчитано в Foodgram'
-        response = HttpResponse(
-            shopping_list, content_type='text.txt; charset=utf-8'
+        ingredients = user.cart_totals.values(
+            name=F('ingredient__name'),
+            measurement_unit=F('ingredient__measurement_unit'),
+            amount=F('total_amount'),
+        ).order_by('name')
+
+        exporter = exporter_class(user, ingredients)
+        response = StreamingHttpResponse(
+            exporter, content_type=exporter.content_type
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename={exporter.filename}'
         )
-        response['Content-Disposition'] = f'attachment; filename={filename}'
         return response
@@ -1,5 +1,5 @@
 import os
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
 
 from decouple import config
 from dotenv import load_dotenv
@@ -43,6 +43,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.SQLInstrumentationMiddleware',
 ]
 
 TEMPLATES = [
@@ -78,6 +79,26 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'recipes': {
+        'BACKEND': config(
+            'RECIPE_CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config(
+            'RECIPE_CACHE_LOCATION', default='recipes'),
+        'TIMEOUT': config(
+            'RECIPE_CACHE_TIMEOUT', default=60, cast=int),
+        'OPTIONS': {
+            'MAX_ENTRIES': config(
+                'RECIPE_CACHE_MAX_ENTRIES', default=1000, cast=int),
+        },
+    },
+}
+RECIPE_CACHE_ALIAS = 'recipes'
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME':
         ('django.contrib.auth.password_validation.'
@@ -104,6 +125,10 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS':
         'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 6,
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 DJOSER = {
     'LOGIN_FIELD': 'email',
@@ -137,6 +162,23 @@ SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('Token',),
 }
 
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'api.slow_requests': {
+            'handlers': ('console',),
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
 AUTH_USER_MODEL = 'users.User'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 USERNAME_LENGTH = 150
@@ -148,6 +190,53 @@ TAG_NAME_LENGTH = 200
 INGRIDIENT_NAME_LENGTH = 200
 RECIPE_NAME_LENGTH = 200
 MEASURMENT_COUNT_LENGTH = 200
+MAX_RECIPES_LIMIT = 50
+MAX_PAGE_SIZE = 100
+SHOPPING_LIST_CHUNK_SIZE = 500
+FUZZY_SEARCH_LIMIT = 20
+FUZZY_SEARCH_THRESHOLD = 0.3
+TRIGRAM_BATCH_SIZE = 1000
+MAX_IMAGE_BYTES = 5 * 1024 * 1024
+MAX_IMAGE_SIDE = 6000
+UPLOAD_CHUNK_SIZE = 64 * 1024
+UPLOAD_TOKEN_TTL_HOURS = 24
+FEED_BATCH_SIZE = 1000
+FEED_BACKFILL_LIMIT = 50
+MAX_BATCH_LINKS = 100
+# Вес события в рейтинге удваивается каждые TRENDING_HALF_LIFE_HOURS от
+# TRENDING_EPOCH, что равносильно затуханию старых событий. Рейтинг хранится
+# как log2 суммы весов: он растёт линейно со временем и не переполняется.
+# TRENDING_EMPTY_SCORE - рейтинг без событий.
+TRENDING_EPOCH = datetime(2026, 1, 1, tzinfo=timezone.utc)
+TRENDING_HALF_LIFE_HOURS = 72
+TRENDING_EMPTY_SCORE = -1e6
+TRENDING_WEIGHTS = {
+    'publish': 1.0,
+    'favorite': 3.0,
+    'cart': 2.0,
+}
+SQL_INSTRUMENTATION = config('SQL_INSTRUMENTATION', default=False, cast=bool)
+SLOW_REQUEST_MS = config('SLOW_REQUEST_MS', default=500, cast=int)
+SLOW_REQUEST_QUERIES = config('SLOW_REQUEST_QUERIES', default=30, cast=int)
+SLOW_REQUEST_DUPLICATES = config(
+    'SLOW_REQUEST_DUPLICATES', default=5, cast=int)
+IMAGE_PROCESSING = config('IMAGE_PROCESSING', default='process')
+IMAGE_PROCESSING_WORKERS = config(
+    'IMAGE_PROCESSING_WORKERS', default=2, cast=int)
+IMAGE_VARIANTS_DIR = 'variants'
+IMAGE_VARIANT_QUALITY = 82
+IMAGE_VARIANTS = {
+    'thumb': (480, 'JPEG'),
+    'thumb_webp': (480, 'WEBP'),
+    'detail_webp': (1280, 'WEBP'),
+}
+IMAGE_VARIANT_FOR_ACTION = {
+    'list': 'thumb_webp',
+    'trending': 'thumb_webp',
+    'feed': 'thumb_webp',
+    'retrieve': 'detail_webp',
+}
 ADD_METHODS = ('GET', 'POST',)
 DEL_METHODS = ('DELETE',)
 ACTION_METHODS = [s.lower() for s in (ADD_METHODS + DEL_METHODS)]
+BATCH_ACTION_METHODS = ('post', 'delete')
@@ -35,7 +35,7 @@ class IngredientAdmin(ModelAdmin):
 @register(Recipe)
 class RecipeAdmin(ModelAdmin):
     list_display = (
-        'name', 'author', 'get_image',
+        'name', 'author', 'get_image', 'favorites_count', 'carts_count',
     )
     fields = (
         ('name', 'cooking_time',),
@@ -0,0 +1,153 @@
+import math
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import (Case, Count, F, FloatField, IntegerField,
+                              OuterRef, Q, Subquery, Value, When)
+from django.db.models.functions import Coalesce, Greatest, Least, Ln, Power
+from django.utils import timezone
+
+from .models import Recipe
+
+User = get_user_model()
+
+# Меньшие разности log2 весов на сумму уже не влияют.
+MIN_EXPONENT = -1000.0
+# Разность log2, при которой вычитаемый вес считается равным рейтингу.
+LOG_PRECISION = 1e-9
+
+RECIPE_COUNTERS = {
+    'favorite': 'favorites_count',
+    'cart': 'carts_count',
+}
+
+
+def trending_weight(event, when=None):
+    """log2 веса события, приведённого к `TRENDING_EPOCH`.
+
+    Свежие события весят экспоненциально больше старых, поэтому рейтинг
+    можно копить сложением и не пересчитывать со временем; в логарифмах
+    вес растёт линейно.
+    """
+    hours = (
+        (when or timezone.now()) - settings.TRENDING_EPOCH
+    ).total_seconds() / 3600
+    return (
+        math.log2(settings.TRENDING_WEIGHTS[event])
+        + hours / settings.TRENDING_HALF_LIFE_HOURS
+    )
+
+
+def increment(field, delta):
+    if delta > 0:
+        return F(field) + delta
+    return Greatest(F(field) + delta, 0)
+
+
+def log2_of(expression):
+    return Ln(expression) / math.log(2)
+
+
+def log_add(field, weight):
+    """`log2(2 ** field + 2 ** weight)` без перехода к самим весам.
+
+    Разность степеней ограничена снизу, чтобы `POWER` не уходил в
+    денормализованные числа.
+    """
+    high = Greatest(F(field), Value(weight))
+    low = Least(F(field), Value(weight))
+    return high + log2_of(
+        1 + Power(2, Greatest(low - high, MIN_EXPONENT))
+    )
+
+
+def log_subtract(field, weight):
+    """`log2(2 ** field - 2 ** weight)`, пустой рейтинг - если вычитать
+    больше нечего."""
+    return Case(
+        When(
+            **{f'{field}__lte': weight + LOG_PRECISION},
+            then=Value(settings.TRENDING_EMPTY_SCORE),
+        ),
+        default=F(field) + log2_of(
+            1 - Power(2, Greatest(weight - F(field), MIN_EXPONENT))
+        ),
+        output_field=FloatField(),
+    )
+
+
+def recipe_published(recipe):
+    Recipe.objects.filter(pk=recipe.pk).update(
+        trending_score=log_add(
+            'trending_score', trending_weight('publish', recipe.pub_date)
+        )
+    )
+
+
+def author_recipes_changed(author_ids, added):
+    User.objects.filter(pk__in=author_ids).update(
+        recipes_count=increment('recipes_count', 1 if added else -1)
+    )
+
+
+def recipe_marked(recipe_ids, event, added, count=1):
+    """Меняет счётчик избранного/корзины и рейтинг рецептов на `count`
+    отметок у каждого.
+
+    Снятие отметки вычитает текущий вес, поэтому частое добавление и
+    удаление не поднимает рецепт в рейтинге.
+    """
+    weight = trending_weight(event) + math.log2(count)
+    Recipe.objects.filter(pk__in=recipe_ids).update(**{
+        RECIPE_COUNTERS[event]: increment(
+            RECIPE_COUNTERS[event], count if added else -count
+        ),
+        'trending_score': (
+            log_add if added else log_subtract
+        )('trending_score', weight),
+    })
+
+
+def author_subscribed(author_ids, added, count=1):
+    User.objects.filter(pk__in=author_ids).update(
+        subscribers_count=increment(
+            'subscribers_count', count if added else -count
+        )
+    )
+
+
+def count_of(through, field):
+    return Coalesce(
+        Subquery(
+            through.objects.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(total=Count('*'))
+            .values('total'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def reconcile():
+    """Сверяет счётчики с таблицами связей и исправляет расхождения.
+
+    Возвращает `{счётчик: число исправленных строк}`.
+    """
+    counters = (
+        (Recipe, 'favorites_count',
+         count_of(Recipe.favorite.through, 'recipe_id')),
+        (Recipe, 'carts_count',
+         count_of(Recipe.cart.through, 'recipe_id')),
+        (User, 'recipes_count',
+         count_of(Recipe, 'author_id')),
+        (User, 'subscribers_count',
+         count_of(User.subscribe.through, 'to_user_id')),
+    )
+    return {
+        field: model.objects.filter(~Q(**{field: real})).update(
+            **{field: real}
+        )
+        for model, field, real in counters
+    }
@@ -0,0 +1,81 @@
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from .models import FeedEntry, Recipe
+
+User = get_user_model()
+Subscription = User.subscribe.through
+
+
+def save_entries(entries):
+    """Пишет записи ленты пачками по `FEED_BATCH_SIZE`."""
+    entries = iter(entries)
+    while True:
+        batch = list(islice(entries, settings.FEED_BATCH_SIZE))
+        if not batch:
+            return
+        FeedEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def fan_out(recipe):
+    """Добавляет новый рецепт в ленты всех подписчиков автора."""
+    save_entries(
+        FeedEntry(
+            user_id=user_id,
+            recipe_id=recipe.pk,
+            author_id=recipe.author_id,
+            pub_date=recipe.pub_date,
+        )
+        for user_id in Subscription.objects.filter(
+            to_user_id=recipe.author_id
+        ).values_list('from_user_id', flat=True).iterator()
+    )
+
+
+def backfill(user_ids, author_ids):
+    """Дописывает в ленты последние рецепты авторов после подписки.
+
+    Рецепты всех авторов читаются одним запросом с ранжированием.
+    """
+    user_ids = list(user_ids)
+    latest = Recipe.objects.latest_by_author(
+        list(author_ids), settings.FEED_BACKFILL_LIMIT
+    )
+    save_entries(
+        FeedEntry(
+            user_id=user_id,
+            recipe_id=recipe.pk,
+            author_id=author_id,
+            pub_date=recipe.pub_date,
+        )
+        for author_id, recipes in latest.items()
+        for recipe in recipes
+        for user_id in user_ids
+    )
+
+
+def trim(user_ids=None, author_ids=None):
+    """Убирает из лент рецепты авторов, от которых отписались."""
+    entries = FeedEntry.objects.all()
+    if user_ids is not None:
+        entries = entries.filter(user_id__in=user_ids)
+    if author_ids is not None:
+        entries = entries.filter(author_id__in=author_ids)
+    entries.delete()
+
+
+def rebuild():
+    """Строит все ленты заново по текущим подпискам."""
+    FeedEntry.objects.all().delete()
+    authors = Subscription.objects.values_list(
+        'to_user_id', flat=True
+    ).distinct().order_by('to_user_id')
+    for author_id in authors.iterator():
+        backfill(
+            Subscription.objects.filter(to_user_id=author_id).values_list(
+                'from_user_id', flat=True
+            ),
+            (author_id,),
+        )
@@ -0,0 +1,182 @@
+import logging
+import os
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+from rest_framework.serializers import ValidationError
+
+logger = logging.getLogger(__name__)
+
+FORMAT_EXTENSIONS = {
+    'JPEG': 'jpg',
+    'WEBP': 'webp',
+}
+UPLOAD_FORMATS = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+    'GIF': 'gif',
+    'WEBP': 'webp',
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def render_variants(source_path, media_root, source_name, variants,
+                    variants_dir, quality):
+    """Сохраняет уменьшенные копии изображения.
+
+    Работает только с файловой системой и Pillow и не читает настройки
+    Django, поэтому выполняется в отдельном процессе. Возвращает
+    `{вариант: имя файла в хранилище}`.
+    """
+    stem = os.path.splitext(os.path.basename(source_name))[0]
+    directory = os.path.join(os.path.dirname(source_name), variants_dir)
+    os.makedirs(os.path.join(media_root, directory), exist_ok=True)
+    result = {}
+    with Image.open(source_path) as source:
+        source = source.convert('RGB')
+        for variant, (max_side, image_format) in variants.items():
+            image = source.copy()
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+            name = os.path.join(
+                directory,
+                f'{stem}_{variant}.{FORMAT_EXTENSIONS[image_format]}',
+            )
+            image.save(
+                os.path.join(media_root, name),
+                image_format,
+                quality=quality,
+            )
+            result[variant] = name
+    return result
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                executor_class = (
+                    ProcessPoolExecutor
+                    if settings.IMAGE_PROCESSING == 'process'
+                    else ThreadPoolExecutor
+                )
+                _executor = executor_class(
+                    max_workers=settings.IMAGE_PROCESSING_WORKERS
+                )
+    return _executor
+
+
+def store_variants(recipe_id, source_name, variants):
+    """Записывает готовые варианты, если изображение не успели сменить."""
+    from .models import Recipe
+    from .signals import bump_recipe_cache
+
+    variants = {'source': source_name, **variants}
+    updated = Recipe.objects.filter(
+        pk=recipe_id, image=source_name
+    ).update(image_variants=variants, updated_at=timezone.now())
+    if updated:
+        bump_recipe_cache('recipe_list', f'recipe:{recipe_id}')
+
+
+def process_recipe_image(recipe_id, source_name):
+    """Строит варианты изображения рецепта в фоне (или сразу в `sync`)."""
+    args = (
+        default_storage.path(source_name),
+        default_storage.location,
+        source_name,
+        settings.IMAGE_VARIANTS,
+        settings.IMAGE_VARIANTS_DIR,
+        settings.IMAGE_VARIANT_QUALITY,
+    )
+    if settings.IMAGE_PROCESSING == 'sync':
+        try:
+            store_variants(recipe_id, source_name, render_variants(*args))
+        except Exception:
+            logger.exception(
+                'Не удалось обработать изображение %s', source_name
+            )
+        return
+
+    submitter = threading.get_ident()
+
+    def done(future):
+        try:
+            store_variants(recipe_id, source_name, future.result())
+        except Exception:
+            logger.exception(
+                'Не удалось обработать изображение %s', source_name
+            )
+        finally:
+            if threading.get_ident() != submitter:
+                connection.close()
+
+    get_executor().submit(render_variants, *args).add_done_callback(done)
+
+
+def schedule_recipe_image(recipe):
+    """Ставит обработку в очередь после фиксации транзакции."""
+    if not recipe.image:
+        return
+    if (recipe.image_variants or {}).get('source') == recipe.image.name:
+        return
+    transaction.on_commit(
+        lambda: process_recipe_image(recipe.pk, recipe.image.name)
+    )
+
+
+def check_upload_size(size):
+    if size > settings.MAX_IMAGE_BYTES:
+        raise ValidationError(
+            'Изображение больше '
+            f'{settings.MAX_IMAGE_BYTES // 1024 // 1024} МБ.'
+        )
+
+
+def store_upload(user, chunks):
+    """Пишет поток байтов во временный файл и сохраняет как `ImageUpload`.
+
+    В памяти одновременно находится не больше одного куска, объём
+    ограничен `MAX_IMAGE_BYTES`, изображение проверяется по заголовку.
+    """
+    from .models import ImageUpload
+
+    with tempfile.TemporaryFile() as buffer:
+        size = 0
+        for chunk in chunks:
+            size += len(chunk)
+            check_upload_size(size)
+            buffer.write(chunk)
+        if not size:
+            raise ValidationError('Файл не передан.')
+        buffer.seek(0)
+        try:
+            with Image.open(buffer) as image:
+                image_format, dimensions = image.format, image.size
+                image.verify()
+        except (UnidentifiedImageError, OSError, SyntaxError):
+            raise ValidationError('Загрузите корректное изображение.')
+        if image_format not in UPLOAD_FORMATS:
+            raise ValidationError('Неподдерживаемый формат изображения.')
+        if max(dimensions) > settings.MAX_IMAGE_SIDE:
+            raise ValidationError(
+                'Сторона изображения больше '
+                f'{settings.MAX_IMAGE_SIDE} пикселей.'
+            )
+        buffer.seek(0)
+        token = uuid.uuid4().hex
+        upload = ImageUpload(user=user, token=token)
+        upload.image.save(
+            f'{token}.{UPLOAD_FORMATS[image_format]}', File(buffer)
+        )
+    return upload
@@ -0,0 +1,112 @@
+import gzip
+import hashlib
+import heapq
+import json
+import threading
+from bisect import bisect_left
+from functools import cached_property
+
+from .models import Ingredient
+from .versions import get_version
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MAX_CHAR = chr(0x10FFFF)
+
+
+class IngredientCatalog:
+    """Весь справочник ингредиентов, заранее сериализованный в JSON и
+    сжатый gzip (и brotli, если он установлен).
+
+    `bodies` - `{content-coding: bytes}`, `identity` - без сжатия.
+    """
+
+    def __init__(self, rows):
+        # Как у JSONRenderer из DRF: компактно, без экранирования юникода.
+        body = json.dumps(
+            rows, ensure_ascii=False, separators=(',', ':')
+        ).replace('\u2028', '\\u2028').replace(
+            '\u2029', '\\u2029'
+        ).encode()
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.bodies = {
+            'identity': body,
+            'gzip': gzip.compress(body, compresslevel=9, mtime=0),
+        }
+        if brotli is not None:
+            self.bodies['br'] = brotli.compress(body, quality=11)
+
+
+class IngredientPrefixIndex:
+    """Отсортированный по `casefold` список ингредиентов для поиска по
+    префиксу двоичным поиском."""
+
+    def __init__(self, rows):
+        self.entries = sorted(
+            (name.casefold(), pk, name, measurement_unit)
+            for pk, name, measurement_unit in rows
+        )
+        self.keys = [entry[0] for entry in self.entries]
+
+    def __len__(self):
+        return len(self.entries)
+
+    @cached_property
+    def catalog(self):
+        """Полный список в порядке `search('')`, строится один раз на
+        версию индекса."""
+        return IngredientCatalog(self.search(''))
+
+    def search(self, prefix, limit=None):
+        """Ингредиенты, начинающиеся с `prefix`.
+
+        Сначала точное совпадение, затем более короткие названия.
+        """
+        prefix = prefix.casefold()
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix + MAX_CHAR, start)
+        if not prefix:
+            positions = range(start, end)[:limit]
+        else:
+            def rank(position):
+                key = self.keys[position]
+                return key != prefix, len(key), key
+
+            if limit is None:
+                positions = sorted(range(start, end), key=rank)
+            else:
+                positions = heapq.nsmallest(
+                    limit, range(start, end), key=rank
+                )
+        return [
+            {
+                'id': self.entries[position][1],
+                'name': self.entries[position][2],
+                'measurement_unit': self.entries[position][3],
+            }
+            for position in positions
+        ]
+
+
+_index = None
+_index_version = None
+_lock = threading.Lock()
+
+
+def get_ingredient_index():
+    """Индекс текущего процесса, перестраивается при смене версии."""
+    global _index, _index_version
+    version = get_version('ingredients')
+    if _index is None or _index_version != version:
+        with _lock:
+            if _index is None or _index_version != version:
+                _index = IngredientPrefixIndex(
+                    Ingredient.objects.values_list(
+                        'id', 'name', 'measurement_unit'
+                    ).iterator()
+                )
+                _index_version = version
+    return _index
@@ -0,0 +1,194 @@
+import json
+import random
+import statistics
+import subprocess
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный прогон основных эндпоинтов через тестовый клиент: '
+            'p50/p95, запросы к БД и пропускная способность в JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--output',
+            help='Куда сохранить результаты в JSON.',
+        )
+        parser.add_argument(
+            '--compare',
+            help='JSON предыдущего прогона для сравнения.',
+        )
+        parser.add_argument(
+            '--only',
+            nargs='*',
+            help='Прогнать только указанные сценарии.',
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+        users = list(
+            User.objects.filter(carts__isnull=False, subscribe__isnull=False)
+            .distinct().order_by('id').values_list('id', flat=True)[:100]
+        )
+        if not recipe_ids or not users:
+            raise CommandError(
+                'Нет данных, сначала выполните manage.py generate_data'
+            )
+        self.recipe_ids = recipe_ids
+        self.users = User.objects.in_bulk(users)
+        self.tags = list(Tag.objects.values_list('slug', flat=True))
+        self.ingredient_names = list(
+            Ingredient.objects.values_list('name', flat=True)[:500]
+        )
+
+        scenarios = {
+            name: scenario for name, scenario in self.scenarios()
+            if not options['only'] or name in options['only']
+        }
+        results = {}
+        for name, (make_url, authenticated) in scenarios.items():
+            results[name] = self.run(
+                make_url, authenticated, options['requests']
+            )
+            self.report(name, results[name])
+
+        previous = self.load(options['compare']) if options['compare'] else {}
+        for name, result in results.items():
+            before = previous.get('results', {}).get(name)
+            if before:
+                self.stdout.write(
+                    f'{name}: p95 {before["p95_ms"]} -> '
+                    f'{result["p95_ms"]} мс, '
+                    f'запросов {before["queries"]} -> {result["queries"]}'
+                )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(
+                    {'meta': self.meta(), 'results': results},
+                    f, ensure_ascii=False, indent=2,
+                )
+            self.stdout.write(self.style.SUCCESS(
+                f'Результаты записаны в {options["output"]}'
+            ))
+
+    def scenarios(self):
+        """`(имя, (функция URL, нужна ли авторизация))`."""
+        rng = self.rng
+        return (
+            ('recipes_list_anonymous', (
+                lambda: f'/api/recipes/?page={rng.randint(1, 20)}', False,
+            )),
+            ('recipes_list', (
+                lambda: f'/api/recipes/?page={rng.randint(1, 20)}', True,
+            )),
+            ('recipes_list_tags', (
+                lambda: '/api/recipes/?' + '&'.join(
+                    f'tags={slug}' for slug in rng.sample(
+                        self.tags, min(2, len(self.tags))
+                    )
+                ), True,
+            )),
+            ('recipes_favorited', (
+                lambda: '/api/recipes/?is_favorited=1', True,
+            )),
+            ('recipe_detail', (
+                lambda: f'/api/recipes/{rng.choice(self.recipe_ids)}/', True,
+            )),
+            ('recipes_trending', (lambda: '/api/recipes/trending/', True)),
+            ('recipes_feed', (lambda: '/api/recipes/feed/', True)),
+            ('subscriptions', (
+                lambda: '/api/users/subscriptions/?recipes_limit=3', True,
+            )),
+            ('download_shopping_cart', (
+                lambda: '/api/recipes/download_shopping_cart/', True,
+            )),
+            ('ingredients_prefix', (
+                lambda: '/api/ingredients/?name='
+                + rng.choice(self.ingredient_names)[:2], False,
+            )),
+        )
+
+    def run(self, make_url, authenticated, count):
+        client = APIClient()
+        user_ids = list(self.users)
+        latencies, queries = [], []
+        started = time.perf_counter()
+        for _ in range(count):
+            for alias in ('default', settings.RECIPE_CACHE_ALIAS):
+                caches[alias].clear()
+            if authenticated:
+                client.force_authenticate(
+                    self.users[self.rng.choice(user_ids)]
+                )
+            else:
+                client.force_authenticate(None)
+            url = make_url()
+            with CaptureQueriesContext(connection) as captured:
+                request_started = time.perf_counter()
+                response = client.get(url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                latencies.append(time.perf_counter() - request_started)
+            if response.status_code >= 400:
+                raise CommandError(f'{url}: {response.status_code}')
+            queries.append(len(captured.captured_queries))
+        elapsed = time.perf_counter() - started
+        latencies_ms = sorted(latency * 1e3 for latency in latencies)
+        return {
+            'requests': count,
+            'p50_ms': round(statistics.median(latencies_ms), 2),
+            'p95_ms': round(
+                latencies_ms[max(0, int(len(latencies_ms) * 0.95) - 1)], 2
+            ),
+            'mean_ms': round(statistics.mean(latencies_ms), 2),
+            'queries': round(statistics.mean(queries), 1),
+            'max_queries': max(queries),
+            'rps': round(count / elapsed, 1),
+        }
+
+    def report(self, name, result):
+        self.stdout.write(
+            f'{name:<24} p50 {result["p50_ms"]:>8.2f} мс  '
+            f'p95 {result["p95_ms"]:>8.2f} мс  '
+            f'запросов {result["queries"]:>5}  '
+            f'{result["rps"]:>7.1f} запр/с'
+        )
+
+    def meta(self):
+        try:
+            commit = subprocess.run(
+                ('git', 'rev-parse', '--short', 'HEAD'),
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'created': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'users': User.objects.count(),
+            'recipes': len(self.recipe_ids),
+            'favorites': Recipe.favorite.through.objects.count(),
+            'carts': Recipe.cart.through.objects.count(),
+            'subscriptions': User.subscribe.through.objects.count(),
+        }
+
+    def load(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as error:
+            raise CommandError(f'{path}: {error}')
@@ -0,0 +1,93 @@
+import base64
+import io
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from recipes import images
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import User
+
+MODES = ('sync', 'process')
+
+
+class Command(BaseCommand):
+    help = ('Задержка создания рецепта с обработкой изображения в запросе '
+            'и в фоновых процессах')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=10)
+        parser.add_argument('--width', type=int, default=3000)
+        parser.add_argument('--height', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        payload_image = self.make_image(options['width'], options['height'])
+        user = User.objects.create(
+            username='bench_image_upload',
+            email='bench_image_upload@example.com',
+            first_name='bench',
+            last_name='bench',
+        )
+        tag = Tag.objects.create(
+            name='bench_image_upload', color='#BE0C01', slug='bench-image'
+        )
+        ingredient = Ingredient.objects.create(
+            name='bench_image_upload', measurement_unit='г'
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        try:
+            for mode in MODES:
+                latencies = self.run_mode(
+                    mode, client, options['requests'], payload_image,
+                    tag, ingredient,
+                )
+                self.stdout.write(
+                    f'{mode:>8}: median {statistics.median(latencies):.1f} '
+                    f'мс, max {max(latencies):.1f} мс'
+                )
+        finally:
+            for recipe in Recipe.objects.filter(author=user):
+                for name in {recipe.image.name, *(
+                    recipe.image_variants or {}
+                ).values()}:
+                    recipe.image.storage.delete(name)
+            user.delete()
+            tag.delete()
+            ingredient.delete()
+
+    def make_image(self, width, height):
+        image = Image.linear_gradient('L').resize((width, height)).convert(
+            'RGB'
+        )
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=90)
+        return (
+            'data:image/jpeg;base64,'
+            + base64.b64encode(buffer.getvalue()).decode()
+        )
+
+    def run_mode(self, mode, client, count, payload_image, tag, ingredient):
+        latencies = []
+        with override_settings(IMAGE_PROCESSING=mode):
+            images._executor = None
+            for number in range(count):
+                started = time.perf_counter()
+                response = client.post('/api/recipes/', {
+                    'name': f'bench {mode} {number}',
+                    'text': 'bench',
+                    'cooking_time': 1,
+                    'tags': [tag.id],
+                    'ingredients': [{'id': ingredient.id, 'amount': 1}],
+                    'image': payload_image,
+                }, format='json')
+                latencies.append((time.perf_counter() - started) * 1000)
+                assert response.status_code == 201, response.content
+            if images._executor is not None:
+                images._executor.shutdown(wait=True)
+                images._executor = None
+        return latencies
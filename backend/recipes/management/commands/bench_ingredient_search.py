@@ -0,0 +1,58 @@
+import random
+import timeit
+
+from django.core.management.base import BaseCommand
+from recipes.ingredient_index import IngredientPrefixIndex
+from recipes.models import Ingredient
+
+
+class Command(BaseCommand):
+    help = 'Сравнение поиска ингредиентов: индекс в памяти и ORM'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rows = list(
+            Ingredient.objects.values_list('id', 'name', 'measurement_unit')
+        )
+        if not rows:
+            self.stdout.write(self.style.WARNING(
+                'Нет ингредиентов, сначала выполните manage.py update'
+            ))
+            return
+        rng = random.Random(options['seed'])
+        prefixes = [
+            name[:rng.randint(1, 4)]
+            for _, name, _ in rng.choices(rows, k=options['queries'])
+        ]
+        limit = options['limit']
+
+        build = timeit.timeit(lambda: IngredientPrefixIndex(rows), number=1)
+        index = IngredientPrefixIndex(rows)
+
+        def run_index():
+            for prefix in prefixes:
+                index.search(prefix, limit)
+
+        def run_orm():
+            for prefix in prefixes:
+                list(Ingredient.objects.filter(
+                    name__istartswith=prefix
+                ).values('id', 'name', 'measurement_unit')[:limit])
+
+        index_time = min(timeit.repeat(run_index, number=1, repeat=3))
+        orm_time = min(timeit.repeat(run_orm, number=1, repeat=3))
+        per_query = 1e6 / len(prefixes)
+        self.stdout.write(
+            f'Ингредиентов: {len(rows)}, запросов: {len(prefixes)}, '
+            f'limit={limit}\n'
+            f'Построение индекса: {build * 1e3:.1f} мс\n'
+            f'Индекс: {index_time * per_query:.1f} мкс/запрос\n'
+            f'ORM:    {orm_time * per_query:.1f} мкс/запрос'
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Ускорение: x{orm_time / index_time:.0f}'
+        ))
@@ -0,0 +1,71 @@
+import json
+import statistics
+import time
+import timeit
+
+from api.renderers import FastJSONRenderer, orjson
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from recipes.models import Recipe
+from users.models import User
+
+VARIANTS = (
+    ('полный', ''),
+    ('карточка', 'fields=id,name,image,cooking_time,is_favorited'),
+    ('без текста', 'omit=text,ingredients'),
+)
+
+
+class Command(BaseCommand):
+    help = ('Страница рецептов в вариантах fields/omit: время запроса, '
+            'число запросов к БД, размер ответа и рендер JSON в DRF '
+            'и orjson')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(carts__isnull=False).first()
+        if user is None or not Recipe.objects.exists():
+            raise CommandError(
+                'Нет данных, сначала выполните manage.py generate_data'
+            )
+        if orjson is None:
+            self.stdout.write(self.style.WARNING(
+                'orjson не установлен, FastJSONRenderer = JSONRenderer'
+            ))
+        client = APIClient()
+        client.force_authenticate(user)
+        drf, fast = JSONRenderer(), FastJSONRenderer()
+        repeat = options['repeat']
+        for title, query in VARIANTS:
+            url = f'/api/recipes/?limit={options["limit"]}&{query}'
+            durations = []
+            for _ in range(repeat):
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = client.get(url)
+                    durations.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise CommandError(f'{url}: {response.status_code}')
+            data = response.data
+            if json.loads(fast.render(data)) != json.loads(drf.render(data)):
+                raise CommandError(f'{title}: рендеры расходятся')
+            drf_time = min(timeit.repeat(
+                lambda: drf.render(data), number=repeat, repeat=3
+            )) / repeat
+            fast_time = min(timeit.repeat(
+                lambda: fast.render(data), number=repeat, repeat=3
+            )) / repeat
+            median = statistics.median(durations)
+            queries = len(captured.captured_queries)
+            self.stdout.write(
+                f'{title:<12} запрос {median * 1e3:7.2f} мс, SQL {queries}, '
+                f'{len(response.content) / 1024:7.1f} КБ, рендер DRF '
+                f'{drf_time * 1e3:6.2f} мс, orjson {fast_time * 1e3:6.2f} мс '
+                f'(x{drf_time / fast_time:.1f})'
+            )
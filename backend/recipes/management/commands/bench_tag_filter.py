@@ -0,0 +1,110 @@
+import random
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes import tag_masks
+from recipes.models import Recipe, Tag
+from users.models import User
+
+TAGS = ('breakfast', 'lunch', 'dinner', 'dessert', 'vegan', 'fast')
+
+
+class Command(BaseCommand):
+    help = ('Фильтр рецептов по нескольким тегам: маска против JOIN '
+            'и DISTINCT. Данные создаются в транзакции и откатываются')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100_000)
+        parser.add_argument('--queries', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.fill(options['recipes'], random.Random(options['seed']))
+            self.compare(options['queries'])
+            transaction.set_rollback(True)
+
+    def fill(self, count, rng):
+        author = User.objects.create(
+            username='bench_tag_filter',
+            email='bench_tag_filter@example.com',
+            first_name='bench',
+            last_name='bench',
+        )
+        tags = [
+            Tag.objects.create(
+                name=f'bench {slug}',
+                color=f'#{number:06X}',
+                slug=f'bench-{slug}',
+            )
+            for number, slug in enumerate(TAGS, start=0xBE0000)
+        ]
+        self.slugs = [tag.slug for tag in tags]
+        recipe_tags = [
+            rng.sample(tags, rng.randint(1, 3)) for _ in range(count)
+        ]
+        Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    author=author,
+                    name=f'bench {number}',
+                    text='bench',
+                    cooking_time=1,
+                    image='bench.jpg',
+                    tag_mask=sum(1 << tag.bit for tag in chosen),
+                )
+                for number, chosen in enumerate(recipe_tags)
+            ),
+            batch_size=5000,
+        )
+        ids = Recipe.objects.filter(author=author).order_by('id').values_list(
+            'id', flat=True
+        )
+        Recipe.tags.through.objects.bulk_create(
+            (
+                Recipe.tags.through(recipe_id=recipe_id, tag_id=tag.id)
+                for recipe_id, chosen in zip(ids, recipe_tags)
+                for tag in chosen
+            ),
+            batch_size=5000,
+        )
+        self.recipes = Recipe.objects.filter(author=author)
+
+    def compare(self, queries):
+        chosen = self.slugs[:3]
+
+        def join_any():
+            recipes = self.recipes.filter(tags__slug__in=chosen).distinct()
+            recipes.count()
+            list(recipes.order_by('-pub_date', '-id')[:6])
+
+        def mask_any():
+            recipes = tag_masks.filter_by_tags(self.recipes, chosen)
+            recipes.count()
+            list(recipes.order_by('-pub_date', '-id')[:6])
+
+        def join_all():
+            recipes = self.recipes
+            for slug in chosen[:2]:
+                recipes = recipes.filter(tags__slug=slug)
+            recipes.count()
+            list(recipes.order_by('-pub_date', '-id')[:6])
+
+        def mask_all():
+            recipes = tag_masks.filter_by_tags(
+                self.recipes, chosen[:2], match_all=True
+            )
+            recipes.count()
+            list(recipes.order_by('-pub_date', '-id')[:6])
+
+        self.stdout.write(f'Рецептов: {self.recipes.count()}')
+        for title, join, mask in (('любой из 3', join_any, mask_any),
+                                  ('все из 2', join_all, mask_all)):
+            join_time = min(timeit.repeat(join, number=queries, repeat=3))
+            mask_time = min(timeit.repeat(mask, number=queries, repeat=3))
+            self.stdout.write(
+                f'{title}: JOIN {join_time / queries * 1e3:.1f} мс, '
+                f'маска {mask_time / queries * 1e3:.1f} мс '
+                f'(x{join_time / mask_time:.1f})'
+            )
@@ -0,0 +1,115 @@
+import base64
+import io
+import math
+import os
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from recipes import images
+from recipes.models import ImageUpload, Ingredient, Recipe, Tag
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ('Пиковая память при создании рецепта с изображением в base64 '
+            'и через потоковую загрузку')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=4,
+            help='Размер изображения, МБ.',
+        )
+
+    def handle(self, *args, **options):
+        raw_image = self.make_image(options['size'] * 1024 * 1024)
+        user = User.objects.create(
+            username='bench_upload_memory',
+            email='bench_upload_memory@example.com',
+            first_name='bench',
+            last_name='bench',
+        )
+        tag = Tag.objects.create(
+            name='bench_upload_memory', color='#BE0C02', slug='bench-memory'
+        )
+        ingredient = Ingredient.objects.create(
+            name='bench_upload_memory', measurement_unit='г'
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        recipe = {
+            'text': 'bench',
+            'cooking_time': 1,
+            'tags': [tag.id],
+            'ingredients': [{'id': ingredient.id, 'amount': 1}],
+        }
+        try:
+            with override_settings(IMAGE_PROCESSING='process'):
+                images._executor = None
+                payload = {**recipe, 'name': 'bench base64', 'image': (
+                    'data:image/jpeg;base64,'
+                    + base64.b64encode(raw_image).decode()
+                )}
+                base64_peak = self.measure(
+                    client.post, '/api/recipes/', payload, format='json'
+                )
+                del payload
+
+                def stream_and_create():
+                    response = client.post(
+                        '/api/uploads/', raw_image, content_type='image/jpeg'
+                    )
+                    assert response.status_code == 201, response.content
+                    return client.post('/api/recipes/', {
+                        **recipe,
+                        'name': 'bench stream',
+                        'image_token': response.data['image_token'],
+                    }, format='json')
+
+                stream_peak = self.measure(stream_and_create)
+                if images._executor is not None:
+                    images._executor.shutdown(wait=True)
+                    images._executor = None
+        finally:
+            for obj in Recipe.objects.filter(author=user):
+                for name in {obj.image.name, *(
+                    obj.image_variants or {}
+                ).values()}:
+                    obj.image.storage.delete(name)
+            for upload in ImageUpload.objects.filter(user=user):
+                upload.image.delete(save=False)
+            user.delete()
+            tag.delete()
+            ingredient.delete()
+
+        megabyte = 1024 * 1024
+        self.stdout.write(
+            f'изображение: {len(raw_image) / megabyte:.1f} МБ\n'
+            f'  base64: пик {base64_peak / megabyte:.1f} МБ\n'
+            f'   поток: пик {stream_peak / megabyte:.1f} МБ'
+        )
+
+    def make_image(self, size):
+        """JPEG из шума: сжимается плохо, размер близок к заданному."""
+        side = int(math.sqrt(size / 1.2))
+        image = Image.frombytes(
+            'RGB', (side, side), os.urandom(side * side * 3)
+        )
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=95)
+        return buffer.getvalue()
+
+    def measure(self, func, *args, **kwargs):
+        tracemalloc.start()
+        try:
+            response = func(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert response.status_code == 201, response.content
+        return peak
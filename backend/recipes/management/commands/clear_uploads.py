@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from recipes.models import ImageUpload, Recipe
+
+
+class Command(BaseCommand):
+    help = 'Удаление загрузок изображений, так и не привязанных к рецептам'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours',
+            type=int,
+            default=settings.UPLOAD_TOKEN_TTL_HOURS,
+            help='Удалять загрузки старше указанного числа часов.',
+        )
+
+    def handle(self, *args, **options):
+        expired = ImageUpload.objects.filter(
+            created__lt=timezone.now() - timedelta(hours=options['hours'])
+        )
+        removed = 0
+        for upload in expired.iterator():
+            if not Recipe.objects.filter(image=upload.image.name).exists():
+                upload.image.delete(save=False)
+            upload.delete()
+            removed += 1
+        self.stdout.write(self.style.SUCCESS(f'Удалено загрузок: {removed}'))
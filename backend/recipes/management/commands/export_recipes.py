@@ -0,0 +1,145 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+from recipes.models import AmountIngredient, Recipe, Tag
+from recipes.transfer import Checkpoint, Progress
+from users.models import User
+
+SECTIONS = ('tag', 'user', 'recipe', 'subscription')
+
+
+class Command(BaseCommand):
+    help = 'Выгрузка тегов, пользователей, рецептов и подписок в JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Путь к файлу .jsonl.')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Сколько объектов читать из базы за один запрос.',
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Продолжить прерванную выгрузку с контрольной точки.',
+        )
+
+    def handle(self, *args, **options):
+        checkpoint = Checkpoint(options['output'])
+        state = checkpoint.load() if options['resume'] else None
+        if state is None:
+            state = {'section': SECTIONS[0], 'last_id': 0, 'offset': 0,
+                     'rows': 0}
+            f = open(options['output'], 'wb')
+        else:
+            f = open(options['output'], 'r+b')
+            f.truncate(state['offset'])
+            f.seek(state['offset'])
+        progress = Progress(
+            self.stdout, state['rows'], verbose=options['verbosity'] > 1
+        )
+
+        with f:
+            for section in SECTIONS[SECTIONS.index(state['section']):]:
+                last_id = (
+                    state['last_id'] if section == state['section'] else 0
+                )
+                export = getattr(self, f'export_{section}s')
+                while True:
+                    rows, last_id = export(last_id, options['batch_size'])
+                    if not rows:
+                        break
+                    f.writelines(
+                        json.dumps(row, ensure_ascii=False).encode() + b'\n'
+                        for row in rows
+                    )
+                    f.flush()
+                    progress.add(len(rows))
+                    checkpoint.save({
+                        'section': section,
+                        'last_id': last_id,
+                        'offset': f.tell(),
+                        'rows': progress.rows,
+                    })
+        checkpoint.remove()
+        self.stdout.write(self.style.SUCCESS(
+            f'Выгружено {progress.summary()}'
+        ))
+
+    def export_tags(self, last_id, batch_size):
+        tags = list(
+            Tag.objects.filter(pk__gt=last_id).order_by('pk')[:batch_size]
+        )
+        return [
+            {'type': 'tag', 'name': tag.name, 'color': tag.color,
+             'slug': tag.slug}
+            for tag in tags
+        ], tags[-1].pk if tags else last_id
+
+    def export_users(self, last_id, batch_size):
+        users = list(
+            User.objects.filter(pk__gt=last_id).order_by('pk').values(
+                'id', 'username', 'email', 'first_name', 'last_name',
+                'password',
+            )[:batch_size]
+        )
+        return [
+            {'type': 'user', **{
+                key: value for key, value in user.items() if key != 'id'
+            }}
+            for user in users
+        ], users[-1]['id'] if users else last_id
+
+    def export_recipes(self, last_id, batch_size):
+        recipes = list(
+            Recipe.objects.filter(pk__gt=last_id).order_by('pk')
+            .select_related('author')
+            .prefetch_related(
+                'tags',
+                Prefetch(
+                    'ingredient',
+                    AmountIngredient.objects.select_related('ingredients'),
+                ),
+                Prefetch('favorite', User.objects.only('username')),
+                Prefetch('cart', User.objects.only('username')),
+            )[:batch_size]
+        )
+        return [
+            {
+                'type': 'recipe',
+                'author': recipe.author.username,
+                'name': recipe.name,
+                'text': recipe.text,
+                'cooking_time': recipe.cooking_time,
+                'image': recipe.image.name,
+                'pub_date': recipe.pub_date.isoformat(),
+                'tags': [tag.slug for tag in recipe.tags.all()],
+                'ingredients': [
+                    [
+                        amount.ingredients.name,
+                        amount.ingredients.measurement_unit,
+                        amount.amount,
+                    ]
+                    for amount in recipe.ingredient.all()
+                ],
+                'favorited_by': [
+                    user.username for user in recipe.favorite.all()
+                ],
+                'in_cart_of': [user.username for user in recipe.cart.all()],
+            }
+            for recipe in recipes
+        ], recipes[-1].pk if recipes else last_id
+
+    def export_subscriptions(self, last_id, batch_size):
+        subscriptions = list(
+            User.subscribe.through.objects.filter(pk__gt=last_id)
+            .order_by('pk')
+            .values_list('pk', 'from_user__username', 'to_user__username')
+            [:batch_size]
+        )
+        return [
+            {'type': 'subscription', 'user': user, 'author': author}
+            for _, user, author in subscriptions
+        ], subscriptions[-1][0] if subscriptions else last_id
@@ -0,0 +1,237 @@
+import random
+import time
+from datetime import timedelta
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from recipes.models import AmountIngredient, Ingredient, Recipe, Tag
+from recipes.transfer import refresh_derived
+from users.models import User
+
+PREFIX = 'gen_'
+PASSWORD = 'generated-password'
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+    ('Десерт', '#F2C94C', 'dessert'),
+    ('Вегетарианское', '#27AE60', 'vegetarian'),
+)
+
+
+def zipf_weights(count, exponent):
+    """Накопленные веса закона Ципфа: немногие объекты получают
+    большую часть связей, как у реальных авторов и рецептов."""
+    return list(
+        accumulate(1 / (rank + 1) ** exponent for rank in range(count))
+    )
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = ('Детерминированная генерация пользователей, рецептов, избранного, '
+            'корзин и подписок для нагрузочных тестов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--favorites', type=float, default=20,
+            help='Среднее число рецептов в избранном у пользователя.',
+        )
+        parser.add_argument(
+            '--carts', type=float, default=5,
+            help='Среднее число рецептов в корзине у пользователя.',
+        )
+        parser.add_argument(
+            '--subscriptions', type=float, default=10,
+            help='Среднее число подписок у пользователя.',
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Сначала удалить ранее сгенерированные данные.',
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.monotonic()
+        if options['clear']:
+            User.objects.filter(username__startswith=PREFIX).delete()
+        if not Ingredient.objects.exists():
+            call_command('update', 'data/ingredients.csv')
+        for name, color, slug in TAGS:
+            Tag.objects.get_or_create(
+                slug=slug, defaults={'name': name, 'color': color}
+            )
+
+        users = self.create_users(options['users'])
+        recipes = self.create_recipes(users, options['recipes'])
+        self.stdout.write('Связи...')
+        recipe_weights = zipf_weights(len(recipes), 1.1)
+        author_weights = zipf_weights(len(users), 1.2)
+        counts = {
+            'favorites': self.link(
+                Recipe.favorite.through, 'user_id', 'recipe_id',
+                users, recipes, recipe_weights, options['favorites'],
+            ),
+            'carts': self.link(
+                Recipe.cart.through, 'user_id', 'recipe_id',
+                users, recipes, recipe_weights, options['carts'],
+            ),
+            'subscriptions': self.link(
+                User.subscribe.through, 'from_user_id', 'to_user_id',
+                users, users, author_weights, options['subscriptions'],
+                exclude_self=True,
+            ),
+        }
+        self.stdout.write('Производные таблицы...')
+        refresh_derived()
+        self.stdout.write(self.style.SUCCESS(
+            f'Пользователей: {len(users)}, рецептов: {len(recipes)}, '
+            + ', '.join(f'{name}: {count}' for name, count in counts.items())
+            + f' ({time.monotonic() - started:.1f} с)'
+        ))
+
+    def create_users(self, count):
+        password = make_password(PASSWORD)
+        existing = set(
+            User.objects.filter(username__startswith=PREFIX).values_list(
+                'username', flat=True
+            )
+        )
+        for batch in batched(
+            (
+                User(
+                    username=f'{PREFIX}{number}',
+                    email=f'{PREFIX}{number}@example.com',
+                    first_name=f'Имя{number}',
+                    last_name=f'Фамилия{number}',
+                    password=password,
+                )
+                for number in range(count)
+                if f'{PREFIX}{number}' not in existing
+            ),
+            self.batch_size,
+        ):
+            User.objects.bulk_create(batch)
+        return list(
+            User.objects.filter(username__startswith=PREFIX)
+            .order_by('id').values_list('id', flat=True)[:count]
+        )
+
+    def create_recipes(self, users, count):
+        """Рецепты по авторам распределены по Ципфу, даты - за год."""
+        rng = self.rng
+        ingredients = list(
+            Ingredient.objects.order_by('id').values_list('id', flat=True)
+        )
+        ingredient_weights = zipf_weights(len(ingredients), 0.8)
+        tags = list(Tag.objects.order_by('id').values_list('id', flat=True))
+        author_weights = zipf_weights(len(users), 1.2)
+        now = timezone.now()
+        existing = Recipe.objects.filter(author_id__in=users).count()
+        plan = [
+            {
+                'author': rng.choices(users, cum_weights=author_weights)[0],
+                'pub_date': now - timedelta(
+                    seconds=rng.randrange(365 * 24 * 3600)
+                ),
+                'tags': rng.sample(tags, rng.randint(1, min(3, len(tags)))),
+                'ingredients': set(rng.choices(
+                    ingredients, cum_weights=ingredient_weights,
+                    k=rng.randint(3, 12),
+                )),
+            }
+            for _ in range(existing, count)
+        ]
+        self.stdout.write(f'Рецепты: {len(plan)}...')
+        for offset, batch in enumerate(batched(plan, self.batch_size)):
+            first = existing + offset * self.batch_size
+            Recipe.objects.bulk_create(
+                Recipe(
+                    author_id=item['author'],
+                    name=f'Рецепт {first + number}',
+                    text='Сгенерированный рецепт.',
+                    cooking_time=rng.randint(5, 180),
+                    image='recipes/images/generated.jpg',
+                )
+                for number, item in enumerate(batch)
+            )
+            names = {
+                f'Рецепт {first + number}': item
+                for number, item in enumerate(batch)
+            }
+            created = list(
+                Recipe.objects.filter(
+                    author_id__in={item['author'] for item in batch},
+                    name__in=names,
+                ).values_list('id', 'name')
+            )
+            Recipe.objects.bulk_update(
+                [
+                    Recipe(pk=pk, pub_date=names[name]['pub_date'])
+                    for pk, name in created
+                ],
+                ('pub_date',),
+            )
+            AmountIngredient.objects.bulk_create(
+                AmountIngredient(
+                    recipe_id=pk,
+                    ingredients_id=ingredient_id,
+                    amount=rng.randint(1, 500),
+                )
+                for pk, name in created
+                for ingredient_id in names[name]['ingredients']
+            )
+            Recipe.tags.through.objects.bulk_create(
+                Recipe.tags.through(recipe_id=pk, tag_id=tag_id)
+                for pk, name in created
+                for tag_id in names[name]['tags']
+            )
+        return list(
+            Recipe.objects.filter(author_id__in=users)
+            .order_by('id').values_list('id', flat=True)
+        )
+
+    def link(self, through, source_field, target_field, sources, targets,
+             cum_weights, mean, exclude_self=False):
+        """Связи с логнормальным числом на пользователя и популярностью
+        целей по Ципфу."""
+        rng = self.rng
+        if not targets or not mean:
+            return 0
+
+        def rows():
+            for source in sources:
+                size = min(
+                    len(targets), int(rng.lognormvariate(0, 1) * mean / 1.65)
+                )
+                chosen = set(
+                    rng.choices(targets, cum_weights=cum_weights, k=size)
+                )
+                if exclude_self:
+                    chosen.discard(source)
+                for target in chosen:
+                    yield through(
+                        **{source_field: source, target_field: target}
+                    )
+
+        before = through.objects.count()
+        for batch in batched(rows(), self.batch_size):
+            through.objects.bulk_create(batch, ignore_conflicts=True)
+        return through.objects.count() - before
@@ -0,0 +1,261 @@
+import json
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from recipes import counters
+from recipes.models import AmountIngredient, Ingredient, Recipe, Tag
+from recipes.transfer import Checkpoint, Progress, refresh_derived
+from users.models import User
+
+TYPES = ('tag', 'user', 'recipe', 'subscription')
+
+
+class Command(BaseCommand):
+    help = 'Загрузка тегов, пользователей, рецептов и подписок из JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='Файл, созданный export_recipes.')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Сколько строк записывать в одной транзакции.',
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Продолжить прерванную загрузку с контрольной точки.',
+        )
+
+    def handle(self, *args, **options):
+        checkpoint = Checkpoint(options['input'])
+        state = checkpoint.load() if options['resume'] else None
+        if state is None:
+            state = {'offset': 0, 'rows': 0}
+        self.stats = defaultdict(int)
+        self.tags = dict(Tag.objects.values_list('slug', 'id'))
+        self.users = dict(User.objects.values_list('username', 'id'))
+        self.ingredients = {
+            (name, measurement_unit): pk
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            )
+        }
+        progress = Progress(
+            self.stdout, state['rows'], verbose=options['verbosity'] > 1
+        )
+
+        try:
+            f = open(options['input'], 'rb')
+        except IOError as error:
+            raise CommandError(error)
+        with f:
+            f.seek(state['offset'])
+            batch = []
+            for line_no, line in enumerate(iter(f.readline, b''), start=1):
+                if not line.strip():
+                    continue
+                try:
+                    batch.append(json.loads(line))
+                except ValueError:
+                    raise CommandError(
+                        f'строка {state["rows"] + line_no}: неверный JSON'
+                    )
+                if len(batch) >= options['batch_size']:
+                    self.save_batch(batch)
+                    progress.add(len(batch))
+                    checkpoint.save({'offset': f.tell(),
+                                     'rows': progress.rows})
+                    batch = []
+            if batch:
+                self.save_batch(batch)
+                progress.add(len(batch))
+        checkpoint.remove()
+        refresh_derived(ingredients_changed=bool(self.stats['ingredients']))
+
+        self.stdout.write(', '.join(
+            f'{name}: {count}' for name, count in sorted(self.stats.items())
+        ))
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено {progress.summary()}'
+        ))
+
+    def save_batch(self, batch):
+        """Пишет пачку строк одной транзакцией.
+
+        Пачка идемпотентна: существующие объекты и связи пропускаются,
+        поэтому повтор после сбоя до сохранения контрольной точки безопасен.
+        """
+        rows = defaultdict(list)
+        for row in batch:
+            if row.get('type') not in TYPES:
+                self.stats['unknown'] += 1
+                continue
+            rows[row['type']].append(row)
+        with transaction.atomic():
+            for row_type in TYPES:
+                if rows[row_type]:
+                    getattr(self, f'save_{row_type}s')(rows[row_type])
+
+    def save_tags(self, rows):
+        new = {
+            row['slug']: row for row in rows if row['slug'] not in self.tags
+        }
+        Tag.objects.bulk_create(
+            (
+                Tag(name=row['name'], color=row['color'], slug=slug)
+                for slug, row in new.items()
+            ),
+            ignore_conflicts=True,
+        )
+        self.tags.update(
+            Tag.objects.filter(slug__in=new).values_list('slug', 'id')
+        )
+        self.stats['tags'] += len(new)
+
+    def save_users(self, rows):
+        new = {
+            row['username']: row for row in rows
+            if row['username'] not in self.users
+        }
+        User.objects.bulk_create(
+            (
+                User(
+                    username=username,
+                    email=row['email'],
+                    first_name=row['first_name'],
+                    last_name=row['last_name'],
+                    password=row['password'],
+                )
+                for username, row in new.items()
+            ),
+            ignore_conflicts=True,
+        )
+        self.users.update(
+            User.objects.filter(username__in=new).values_list(
+                'username', 'id'
+            )
+        )
+        self.stats['users'] += len(new)
+
+    def save_ingredients(self, keys):
+        """Создаёт ингредиенты, которых ещё нет в справочнике."""
+        new = {key for key in keys if key not in self.ingredients}
+        if not new:
+            return
+        Ingredient.objects.bulk_create(
+            (
+                Ingredient(name=name, measurement_unit=measurement_unit)
+                for name, measurement_unit in new
+            ),
+            ignore_conflicts=True,
+        )
+        for pk, name, measurement_unit in Ingredient.objects.filter(
+            name__in={name for name, _ in new}
+        ).values_list('id', 'name', 'measurement_unit'):
+            self.ingredients[name, measurement_unit] = pk
+        self.stats['ingredients'] += len(new)
+
+    def save_recipes(self, rows):
+        total = len(rows)
+        rows = [row for row in rows if row['author'] in self.users]
+        keys = {(self.users[row['author']], row['name']) for row in rows}
+        existing = set(
+            Recipe.objects.filter(
+                author_id__in={author_id for author_id, _ in keys},
+                name__in={name for _, name in keys},
+            ).values_list('author_id', 'name')
+        )
+        rows = [
+            row for row in rows
+            if (self.users[row['author']], row['name']) not in existing
+        ]
+        self.stats['skipped'] += total - len(rows)
+        if not rows:
+            return
+        self.save_ingredients(
+            (name, measurement_unit)
+            for row in rows
+            for name, measurement_unit, _ in row['ingredients']
+        )
+        Recipe.objects.bulk_create(
+            Recipe(
+                author_id=self.users[row['author']],
+                name=row['name'],
+                text=row['text'],
+                cooking_time=row['cooking_time'],
+                image=row['image'],
+            )
+            for row in rows
+        )
+        ids = {
+            (author_id, name): pk
+            for pk, author_id, name in Recipe.objects.filter(
+                author_id__in={self.users[row['author']] for row in rows},
+                name__in={row['name'] for row in rows},
+            ).values_list('id', 'author_id', 'name')
+        }
+        created = [
+            (ids[self.users[row['author']], row['name']], row) for row in rows
+        ]
+        # bulk_create проставляет auto_now_add, возвращаем исходные даты.
+        published = [
+            (pk, parse_datetime(row['pub_date'])) for pk, row in created
+        ]
+        Recipe.objects.bulk_update(
+            [
+                Recipe(
+                    pk=pk,
+                    pub_date=pub_date,
+                    trending_score=counters.trending_weight(
+                        'publish', pub_date
+                    ),
+                )
+                for pk, pub_date in published
+            ],
+            ('pub_date', 'trending_score'),
+        )
+        AmountIngredient.objects.bulk_create(
+            AmountIngredient(
+                recipe_id=pk,
+                ingredients_id=self.ingredients[name, measurement_unit],
+                amount=amount,
+            )
+            for pk, row in created
+            for name, measurement_unit, amount in row['ingredients']
+        )
+        Recipe.tags.through.objects.bulk_create(
+            (
+                Recipe.tags.through(recipe_id=pk, tag_id=self.tags[slug])
+                for pk, row in created
+                for slug in row['tags'] if slug in self.tags
+            ),
+            ignore_conflicts=True,
+        )
+        for field, relation in (('favorited_by', Recipe.favorite),
+                                ('in_cart_of', Recipe.cart)):
+            relation.through.objects.bulk_create(
+                (
+                    relation.through(recipe_id=pk, user_id=self.users[user])
+                    for pk, row in created
+                    for user in row[field] if user in self.users
+                ),
+                ignore_conflicts=True,
+            )
+        self.stats['recipes'] += len(created)
+
+    def save_subscriptions(self, rows):
+        User.subscribe.through.objects.bulk_create(
+            (
+                User.subscribe.through(
+                    from_user_id=self.users[row['user']],
+                    to_user_id=self.users[row['author']],
+                )
+                for row in rows
+                if row['user'] in self.users and row['author'] in self.users
+            ),
+            ignore_conflicts=True,
+        )
+        self.stats['subscriptions'] += len(rows)
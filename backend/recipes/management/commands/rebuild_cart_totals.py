@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from recipes.models import ShoppingCartTotal
+
+
+class Command(BaseCommand):
+    help = 'Пересборка и проверка итогов списков покупок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify-only',
+            action='store_true',
+            help='Только сравнить таблицу итогов с живым подсчётом.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Размер пачки для bulk_create.',
+        )
+
+    def handle(self, *args, **options):
+        if not options['verify_only']:
+            ShoppingCartTotal.objects.rebuild(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS('Итоги пересобраны'))
+
+        live = ShoppingCartTotal.objects.aggregate_live()
+        stored = {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total
+            in ShoppingCartTotal.objects.values_list(
+                'user_id', 'ingredient_id', 'total_amount'
+            )
+        }
+        mismatches = [
+            (key, stored.get(key), live.get(key))
+            for key in live.keys() | stored.keys()
+            if stored.get(key) != live.get(key)
+        ]
+        for (user_id, ingredient_id), stored_total, live_total in sorted(
+            mismatches, key=lambda mismatch: mismatch[0]
+        ):
+            self.stdout.write(self.style.WARNING(
+                f'user={user_id} ingredient={ingredient_id}: '
+                f'в таблице {stored_total}, по факту {live_total}'
+            ))
+        if mismatches:
+            self.stdout.write(self.style.WARNING(
+                f'Расхождений: {len(mismatches)}'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Итоги совпадают ({len(live)} строк)'
+            ))
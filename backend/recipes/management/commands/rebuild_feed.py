@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes import feed
+from recipes.models import FeedEntry
+
+
+class Command(BaseCommand):
+    help = 'Пересборка лент подписок по текущим подпискам'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            feed.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Записей в лентах: {FeedEntry.objects.count()}'
+        ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes import tag_masks
+from recipes.models import Tag
+
+
+class Command(BaseCommand):
+    help = 'Раздача битов тегам и пересчёт масок тегов у рецептов'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            tag_masks.rebuild()
+        without_bit = Tag.objects.filter(bit__isnull=True).count()
+        if without_bit:
+            self.stdout.write(self.style.WARNING(
+                f'Тегов без бита: {without_bit}, они фильтруются подзапросом'
+            ))
+        self.stdout.write(self.style.SUCCESS('Маски тегов пересчитаны'))
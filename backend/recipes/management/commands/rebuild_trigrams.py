@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from recipes import trigrams
+from recipes.models import TrigramEntry
+
+
+class Command(BaseCommand):
+    help = 'Пересборка триграммного индекса названий'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--kind',
+            choices=[kind for kind, _ in TrigramEntry.KINDS],
+            help='Пересобрать только ингредиенты или только рецепты.',
+        )
+
+    def handle(self, *args, **options):
+        kinds = (
+            (options['kind'],) if options['kind'] else trigrams.MODELS.keys()
+        )
+        for kind in kinds:
+            trigrams.rebuild(kind)
+            self.stdout.write(self.style.SUCCESS(
+                f'{kind}: {TrigramEntry.objects.filter(kind=kind).count()} '
+                'триграмм'
+            ))
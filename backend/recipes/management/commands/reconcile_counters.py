@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes import counters
+
+
+class Command(BaseCommand):
+    help = 'Сверка счётчиков избранного, корзин, рецептов и подписчиков'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            fixed = counters.reconcile()
+        for field, count in fixed.items():
+            style = self.style.WARNING if count else self.style.SUCCESS
+            self.stdout.write(style(f'{field}: исправлено строк {count}'))
@@ -1,36 +1,186 @@
 import csv
+import json
 import os.path
+import time
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
-from recipes.models import Ingredient
+from django.db import transaction
+from recipes import trigrams
+from recipes.models import Ingredient, TrigramEntry
+from recipes.versions import bump_version
+
+DATA_FILES = ('data/ingredients.csv', 'data/ingredients.json')
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class RowError(Exception):
+    """Ошибка в отдельной строке файла."""
+
+
+def iter_csv(f):
+    for line_no, row in enumerate(csv.reader(f), start=1):
+        if len(row) != 2:
+            yield line_no, RowError(
+                f'ожидалось 2 колонки, получено {len(row)}'
+            )
+            continue
+        yield line_no, row
+
+
+def iter_json(f):
+    """Потоково читает JSON-массив объектов, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer, position, eof = '', 0, False
+    started = False
+    item_no = 0
+    while True:
+        separators = ' \t\r\n,' if started else ' \t\r\n'
+        while position < len(buffer) and buffer[position] in separators:
+            position += 1
+        try:
+            if position == len(buffer):
+                raise json.JSONDecodeError('нужны данные', buffer, position)
+            if not started:
+                if buffer[position] != '[':
+                    raise ValueError('ожидался JSON-массив')
+                position += 1
+                started = True
+                continue
+            if buffer[position] == ']':
+                return
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise ValueError('файл оборвался или повреждён')
+            chunk = f.read(READ_CHUNK_SIZE)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        item_no += 1
+        if not isinstance(item, dict):
+            yield item_no, RowError('ожидался объект')
+            continue
+        try:
+            yield item_no, (item['name'], item['measurement_unit'])
+        except KeyError as error:
+            yield item_no, RowError(f'нет поля {error}')
+
+
+READERS = {
+    '.csv': iter_csv,
+    '.json': iter_json,
+}
 
 
 class Command(BaseCommand):
     help = 'Загрузка списка ингредиентов'
 
-    def handle(self, *args, **kwargs):
-        file_name = 'data/ingredients.csv'
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'files',
+            nargs='*',
+            default=DATA_FILES,
+            help='Файлы .csv или .json относительно BASE_DIR.',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только проверить файлы, ничего не записывая.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Размер пачки для bulk_create.',
+        )
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+        self.seen = set(
+            Ingredient.objects.values_list('name', 'measurement_unit')
+        )
+        self.batch = []
+        self.stats = {'read': 0, 'created': 0, 'skipped': 0}
+        self.errors = []
+        started = time.monotonic()
+
+        with transaction.atomic():
+            for file_name in options['files']:
+                self.load_file(file_name)
+            self.flush()
+            if self.stats['created'] and not self.dry_run:
+                transaction.on_commit(self.refresh_indexes)
+
+        self.report(time.monotonic() - started)
+
+    def load_file(self, file_name):
         file_path = os.path.abspath(
             os.path.join(settings.BASE_DIR, file_name)
         )
+        reader = READERS.get(os.path.splitext(file_name)[1].lower())
+        if reader is None:
+            self.errors.append((file_name, None, 'неизвестный формат файла'))
+            return
         try:
             with open(file_path, newline='', encoding='utf-8') as f:
-                reader = csv.reader(f)
-                try:
-                    for row in reader:
-                        Ingredient.objects.update_or_create(
-                            name=row[0],
-                            measurement_unit=row[1]
-                        )
-                    self.stdout.write(self.style.SUCCESS(
-                        'Ингредиенты успешно добавлены'
-                    ))
-                except Exception:
-                    self.stdout.write(self.style.WARNING('Ошибка'))
+                for row_no, row in reader(f):
+                    self.stats['read'] += 1
+                    try:
+                        self.add_row(row)
+                    except RowError as error:
+                        self.errors.append((file_name, row_no, str(error)))
         except IOError:
             self.stdout.write(
                 self.style.WARNING(
                     f'проверьте наличие файла {file_name} в {file_path}'
                 )
             )
+        except ValueError as error:
+            self.errors.append((file_name, None, f'файл не разобран: {error}'))
+
+    def add_row(self, row):
+        if isinstance(row, RowError):
+            raise row
+        name, measurement_unit = (str(value).strip() for value in row)
+        if not name or not measurement_unit:
+            raise RowError('пустое название или единица измерения')
+        if len(name) > settings.INGRIDIENT_NAME_LENGTH:
+            raise RowError('слишком длинное название')
+        if len(measurement_unit) > settings.MEASURMENT_COUNT_LENGTH:
+            raise RowError('слишком длинная единица измерения')
+        if (name, measurement_unit) in self.seen:
+            self.stats['skipped'] += 1
+            return
+        self.seen.add((name, measurement_unit))
+        self.batch.append(
+            Ingredient(name=name, measurement_unit=measurement_unit)
+        )
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.batch and not self.dry_run:
+            Ingredient.objects.bulk_create(self.batch)
+        self.stats['created'] += len(self.batch)
+        self.batch = []
+
+    def refresh_indexes(self):
+        """bulk_create не отправляет сигналы, обновляем индексы сами."""
+        trigrams.rebuild(TrigramEntry.INGREDIENT)
+        bump_version('ingredients')
+
+    def report(self, elapsed):
+        for file_name, row_no, message in self.errors:
+            location = f'{file_name}:{row_no}' if row_no else file_name
+            self.stdout.write(self.style.WARNING(f'{location}: {message}'))
+        created = 'Будет добавлено' if self.dry_run else 'Добавлено'
+        summary = (
+            f'Прочитано строк: {self.stats["read"]}, '
+            f'{created}: {self.stats["created"]}, '
+            f'уже есть: {self.stats["skipped"]}, '
+            f'ошибок: {len(self.errors)} ({elapsed:.2f} с)'
+        )
+        style = self.style.WARNING if self.errors else self.style.SUCCESS
+        self.stdout.write(style(summary))
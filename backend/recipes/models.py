@@ -1,16 +1,27 @@
+from functools import reduce
+from itertools import islice
+from operator import or_
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db.models import (CASCADE, CharField, DateTimeField, ForeignKey,
-                              ImageField, ManyToManyField, Model,
-                              PositiveSmallIntegerField, SlugField, TextField,
-                              UniqueConstraint)
-from django.db.models.functions import Length
+from django.db import transaction
+from django.db.models import (CASCADE, BigIntegerField, Case, CharField,
+                              DateTimeField, Exists, F, FloatField, ForeignKey,
+                              ImageField, Index, IntegerField, JSONField,
+                              Manager, ManyToManyField, Model, OuterRef,
+                              PositiveIntegerField, PositiveSmallIntegerField,
+                              Prefetch, Q, QuerySet, SlugField, Sum, TextField,
+                              UniqueConstraint, Value, When, Window)
+from django.db.models.functions import Greatest, Length, RowNumber
 
 CharField.register_lookup(Length)
 
 User = get_user_model()
 
+# Строк итогов списка покупок в одном UPDATE.
+APPLY_BATCH_SIZE = 500
+
 
 class Tag(Model):
     """Тег для рецепта."""
@@ -32,6 +43,12 @@ class Tag(Model):
         verbose_name='Метка URL',
         blank=False,
     )
+    bit = PositiveSmallIntegerField(
+        verbose_name='Бит в маске тегов рецепта',
+        unique=True,
+        null=True,
+        editable=False,
+    )
 
     class Meta:
         ordering = ('id',)
@@ -68,6 +85,84 @@ class Ingredient(Model):
         return f'{self.name} {self.measurement_unit}'
 
 
+class RecipeQuerySet(QuerySet):
+    """Выборки рецептов для пакетного чтения."""
+
+    def with_related(self, fields=None):
+        """Подгружает автора, теги и ингредиенты фиксированным числом
+        запросов.
+
+        `fields` - поля ответа, связи остальных полей не читаются.
+        """
+        queryset = self
+        if fields is None or 'author' in fields:
+            queryset = queryset.select_related('author')
+        if fields is None or 'tags' in fields:
+            queryset = queryset.prefetch_related('tags')
+        if fields is None or 'ingredients' in fields:
+            queryset = queryset.prefetch_related(Prefetch(
+                'ingredient',
+                queryset=AmountIngredient.objects.select_related(
+                    'ingredients'
+                ).order_by('ingredients__name'),
+            ))
+        return queryset
+
+    def with_user_flags(self, user, fields=None):
+        """Аннотирует избранное, список покупок и подписку на автора.
+
+        `fields` - поля ответа, флаги остальных полей не считаются.
+        """
+        if user.is_anonymous:
+            return self
+        flags = {
+            'is_favorited': ('is_favorited', Exists(
+                Recipe.favorite.through.objects.filter(
+                    recipe_id=OuterRef('pk'), user_id=user.id
+                )
+            )),
+            'is_in_shopping_cart': ('is_in_shopping_cart', Exists(
+                Recipe.cart.through.objects.filter(
+                    recipe_id=OuterRef('pk'), user_id=user.id
+                )
+            )),
+            'author': ('author_is_subscribed', Exists(
+                User.subscribe.through.objects.filter(
+                    from_user_id=user.id, to_user_id=OuterRef('author_id')
+                )
+            )),
+        }
+        return self.annotate(**dict(
+            annotation for field, annotation in flags.items()
+            if fields is None or field in fields
+        ))
+
+    def latest_by_author(self, author_ids, limit):
+        """Последние `limit` рецептов каждого автора одним запросом.
+
+        Возвращает словарь `{author_id: [recipe, ...]}`.
+        """
+        ranked = self.filter(author_id__in=author_ids).only(
+            'id', 'name', 'image', 'image_variants', 'cooking_time', 'author',
+            'pub_date',
+        ).annotate(
+            author_rank=Window(
+                expression=RowNumber(),
+                partition_by=[F('author_id')],
+                order_by=(F('pub_date').desc(), F('id').desc()),
+            )
+        )
+        sql, params = ranked.query.sql_with_params()
+        recipes = {author_id: [] for author_id in author_ids}
+        for recipe in self.model.objects.raw(
+            f'SELECT * FROM ({sql}) ranked '
+            'WHERE ranked.author_rank <= %s ORDER BY ranked.author_rank',
+            (*params, limit),
+        ):
+            recipes[recipe.author_id].append(recipe)
+        return recipes
+
+
 class Recipe(Model):
     """Модель рецептов."""
     name = CharField(
@@ -105,10 +200,45 @@ class Recipe(Model):
         verbose_name='Дата публикации',
         auto_now_add=True,
     )
+    updated_at = DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+    )
+    version = PositiveIntegerField(
+        verbose_name='Версия',
+        default=1,
+        editable=False,
+    )
     image = ImageField(
         verbose_name='Изображение',
         upload_to='recipes/images/',
     )
+    image_variants = JSONField(
+        verbose_name='Уменьшенные копии изображения',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
+    favorites_count = PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False,
+    )
+    carts_count = PositiveIntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+        editable=False,
+    )
+    trending_score = FloatField(
+        verbose_name='Популярность',
+        default=settings.TRENDING_EMPTY_SCORE,
+        editable=False,
+    )
+    tag_mask = BigIntegerField(
+        verbose_name='Маска тегов',
+        default=0,
+        editable=False,
+    )
     text = TextField(
         verbose_name='Описание',
     )
@@ -125,6 +255,18 @@ class Recipe(Model):
         ),
     )
 
+    objects = RecipeQuerySet.as_manager()
+
+    # Ведутся условными UPDATE и сигналами, обычный save() их не пишет.
+    DERIVED_FIELDS = frozenset((
+        'version',
+        'image_variants',
+        'favorites_count',
+        'carts_count',
+        'trending_score',
+        'tag_mask',
+    ))
+
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
@@ -135,10 +277,27 @@ class Recipe(Model):
                 name='unique_for_author'
             ),
         )
+        indexes = (
+            Index(fields=('-pub_date', '-id'), name='recipe_pub_date_id'),
+            Index(
+                fields=('-trending_score', '-id'), name='recipe_trending'
+            ),
+        )
 
     def __str__(self) -> str:
         return f'{self.name}. Автор: {self.author.username}'
 
+    def save(self, *args, **kwargs):
+        """Существующий рецепт сохраняется без `DERIVED_FIELDS`: в памяти
+        они могут быть старше, чем в базе."""
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.DERIVED_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
 
 class AmountIngredient(Model):
     """Ингридиенты в блюде"""
@@ -180,3 +339,302 @@ class AmountIngredient(Model):
 
     def __str__(self) -> str:
         return f'{self.amount} {self.ingredients}'
+
+
+class ShoppingCartTotalManager(Manager):
+    """Инкрементальное обновление итогов списка покупок."""
+
+    def apply(self, deltas):
+        """Применяет изменения вида `{(user_id, ingredient_id): delta}`.
+
+        Недостающие строки вставляются с пропуском конфликтов, затем все
+        меняются относительным UPDATE, поэтому параллельные транзакции
+        не падают на уникальном индексе и не теряют изменения друг друга.
+        """
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        keys = iter(deltas)
+        with transaction.atomic():
+            while True:
+                batch = list(islice(keys, APPLY_BATCH_SIZE))
+                if not batch:
+                    return
+                self.bulk_create(
+                    [
+                        self.model(
+                            user_id=user_id,
+                            ingredient_id=ingredient_id,
+                            total_amount=0,
+                        )
+                        for user_id, ingredient_id in batch
+                        if deltas[user_id, ingredient_id] > 0
+                    ],
+                    ignore_conflicts=True,
+                )
+                rows = {
+                    key: Q(user_id=key[0], ingredient_id=key[1])
+                    for key in batch
+                }
+                totals = self.filter(reduce(or_, rows.values()))
+                totals.update(total_amount=Greatest(
+                    F('total_amount') + Case(
+                        *(
+                            When(row, then=Value(deltas[key]))
+                            for key, row in rows.items()
+                        ),
+                        default=Value(0),
+                        output_field=IntegerField(),
+                    ),
+                    0,
+                ))
+                totals.filter(total_amount=0).delete()
+
+    def recipes_amounts(self, recipe_ids):
+        """`{ingredient_id: amount}` - суммарный состав рецептов."""
+        return dict(
+            AmountIngredient.objects.filter(recipe_id__in=recipe_ids)
+            .values_list('ingredients_id')
+            .annotate(total=Sum('amount'))
+            .order_by()
+        )
+
+    def change_carts(self, user_ids, recipe_ids, added):
+        """Учитывает рецепты, добавленные в списки покупок пользователей
+        или удалённые из них."""
+        sign = 1 if added else -1
+        amounts = self.recipes_amounts(recipe_ids)
+        self.apply({
+            (user_id, ingredient_id): sign * amount
+            for user_id in user_ids
+            for ingredient_id, amount in amounts.items()
+        })
+
+    def change_recipe(self, recipe, old_amounts, new_amounts):
+        """Переносит изменение состава рецепта на всех, у кого он в корзине.
+
+        `old_amounts` и `new_amounts` - словари `{ingredient_id: amount}`.
+        """
+        changes = {
+            ingredient_id: (
+                new_amounts.get(ingredient_id, 0)
+                - old_amounts.get(ingredient_id, 0)
+            )
+            for ingredient_id in old_amounts.keys() | new_amounts.keys()
+        }
+        self.apply({
+            (user_id, ingredient_id): delta
+            for user_id in Recipe.cart.through.objects.filter(
+                recipe_id=recipe.pk
+            ).values_list('user_id', flat=True)
+            for ingredient_id, delta in changes.items()
+        })
+
+    def aggregate_live(self):
+        """Итоги, посчитанные заново по корзинам и составам рецептов."""
+        return {
+            (row['user_id'], row['ingredient_id']): row['total']
+            for row in AmountIngredient.objects.filter(
+                recipe__cart__isnull=False
+            ).values(
+                user_id=F('recipe__cart'),
+                ingredient_id=F('ingredients'),
+            ).annotate(total=Sum('amount')).order_by()
+        }
+
+    def rebuild(self, batch_size=None):
+        """Пересобирает таблицу итогов целиком."""
+        with transaction.atomic():
+            self.all().delete()
+            self.bulk_create(
+                (
+                    self.model(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        total_amount=total,
+                    )
+                    for (user_id, ingredient_id), total
+                    in self.aggregate_live().items()
+                ),
+                batch_size=batch_size,
+            )
+
+
+class ShoppingCartTotal(Model):
+    """Суммарное количество ингредиента в списке покупок пользователя."""
+    user = ForeignKey(
+        verbose_name='Пользователь',
+        related_name='cart_totals',
+        to=User,
+        on_delete=CASCADE,
+    )
+    ingredient = ForeignKey(
+        verbose_name='Ингредиент',
+        related_name='cart_totals',
+        to=Ingredient,
+        on_delete=CASCADE,
+    )
+    total_amount = PositiveIntegerField(
+        verbose_name='Общее количество',
+        default=0,
+    )
+
+    objects = ShoppingCartTotalManager()
+
+    class Meta:
+        verbose_name = 'Итог списка покупок'
+        verbose_name_plural = 'Итоги списков покупок'
+        ordering = ('user', 'ingredient')
+        constraints = (
+            UniqueConstraint(
+                fields=('user', 'ingredient', ),
+                name='unique_cart_total',
+            ),
+        )
+
+    def __str__(self) -> str:
+        return f'{self.user}: {self.total_amount} {self.ingredient}'
+
+
+class TrigramEntry(Model):
+    """Триграмма названия ингредиента или рецепта для нечёткого поиска."""
+    INGREDIENT = 'ingredient'
+    RECIPE = 'recipe'
+    KINDS = (
+        (INGREDIENT, 'Ингредиент'),
+        (RECIPE, 'Рецепт'),
+    )
+
+    kind = CharField(
+        verbose_name='Тип объекта',
+        max_length=16,
+        choices=KINDS,
+    )
+    object_id = PositiveIntegerField(
+        verbose_name='Идентификатор объекта',
+    )
+    trigram = CharField(
+        verbose_name='Триграмма',
+        max_length=3,
+    )
+    total = PositiveSmallIntegerField(
+        verbose_name='Триграмм в названии',
+    )
+
+    class Meta:
+        verbose_name = 'Триграмма'
+        verbose_name_plural = 'Триграммы'
+        indexes = (
+            Index(
+                fields=('kind', 'trigram', 'object_id'),
+                name='trigram_lookup',
+            ),
+            Index(
+                fields=('kind', 'object_id'),
+                name='trigram_object',
+            ),
+        )
+
+    def __str__(self) -> str:
+        return f'{self.kind} {self.object_id}: {self.trigram!r}'
+
+
+class ImageUpload(Model):
+    """Изображение, загруженное потоком и ожидающее привязки к рецепту."""
+    token = CharField(
+        verbose_name='Токен загрузки',
+        max_length=32,
+        unique=True,
+    )
+    user = ForeignKey(
+        verbose_name='Пользователь',
+        related_name='image_uploads',
+        to=User,
+        on_delete=CASCADE,
+    )
+    image = ImageField(
+        verbose_name='Изображение',
+        upload_to='recipes/images/',
+    )
+    created = DateTimeField(
+        verbose_name='Дата загрузки',
+        auto_now_add=True,
+    )
+
+    class Meta:
+        verbose_name = 'Загрузка изображения'
+        verbose_name_plural = 'Загрузки изображений'
+        ordering = ('-created', )
+
+    def __str__(self) -> str:
+        return f'{self.user}: {self.image.name}'
+
+
+class FeedEntry(Model):
+    """Рецепт в ленте подписчика, записывается при публикации."""
+    user = ForeignKey(
+        verbose_name='Подписчик',
+        related_name='feed_entries',
+        to=User,
+        on_delete=CASCADE,
+    )
+    recipe = ForeignKey(
+        verbose_name='Рецепт',
+        related_name='feed_entries',
+        to=Recipe,
+        on_delete=CASCADE,
+    )
+    author = ForeignKey(
+        verbose_name='Автор',
+        related_name='+',
+        to=User,
+        on_delete=CASCADE,
+    )
+    pub_date = DateTimeField(
+        verbose_name='Дата публикации',
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Лента подписок'
+        constraints = (
+            UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_feed_entry',
+            ),
+        )
+        indexes = (
+            Index(
+                fields=('user', '-pub_date', '-recipe'),
+                name='feed_timeline',
+            ),
+            Index(fields=('user', 'author'), name='feed_user_author'),
+        )
+
+    def __str__(self) -> str:
+        return f'{self.user}: {self.recipe}'
+
+
+class DataVersion(Model):
+    """Версия набора данных, общая для всех процессов.
+
+    По ней процессы сбрасывают свои индексы в памяти, а ответы - ETag и
+    поколения кеша.
+    """
+    name = CharField(
+        verbose_name='Набор данных',
+        max_length=64,
+        unique=True,
+    )
+    version = BigIntegerField(
+        verbose_name='Версия',
+        default=0,
+    )
+    modified = DateTimeField(
+        verbose_name='Дата изменения',
+    )
+
+    class Meta:
+        verbose_name = 'Версия данных'
+        verbose_name_plural = 'Версии данных'
+
+    def __str__(self) -> str:
+        return f'{self.name}: {self.version}'
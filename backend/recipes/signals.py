@@ -0,0 +1,304 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from . import counters, feed, images, tag_masks, trigrams
+from .models import (AmountIngredient, Ingredient, Recipe, ShoppingCartTotal,
+                     Tag)
+from .versions import bump_version
+
+User = get_user_model()
+
+
+def bump_recipe_cache(*names):
+    """Сбрасывает поколения кеша рецептов после фиксации транзакции."""
+    def bump():
+        for name in names:
+            bump_version(name)
+    transaction.on_commit(bump)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredients_changed(**kwargs):
+    """Сбрасывает версию справочника ингредиентов."""
+    bump_version('ingredients')
+    bump_recipe_cache('recipes')
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tags_changed(**kwargs):
+    """Сбрасывает версию списка тегов."""
+    bump_version('tags')
+    bump_recipe_cache('recipes')
+
+
+@receiver(pre_save, sender=Tag)
+def assign_tag_bit(instance, **kwargs):
+    """Новый тег получает свободный бит в маске рецептов."""
+    if instance.bit is None:
+        instance.bit = tag_masks.free_bit()
+
+
+@receiver(post_delete, sender=Tag)
+def release_tag_bit(instance, **kwargs):
+    if instance.bit is not None:
+        tag_masks.clear_bit(instance.bit)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(instance, action, reverse, pk_set, **kwargs):
+    """Поддерживает маску тегов рецепта."""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        tag_masks.refresh_masks((instance.pk,))
+    elif action == 'post_clear':
+        if instance.bit is not None:
+            tag_masks.clear_bit(instance.bit)
+    else:
+        tag_masks.refresh_masks(pk_set)
+
+
+@receiver((post_save, post_delete), sender=User)
+def user_changed(instance, update_fields=None, **kwargs):
+    """Данные автора входят в ответы с рецептами."""
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    bump_recipe_cache('recipes')
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipe_changed(instance, **kwargs):
+    bump_recipe_cache('recipe_list', f'recipe:{instance.pk}')
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_saved(instance, **kwargs):
+    """Запускает построение уменьшенных копий нового изображения."""
+    images.schedule_recipe_image(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_published(instance, created, **kwargs):
+    """Раскладывает новый рецепт по лентам подписчиков автора."""
+    if created:
+        transaction.on_commit(lambda: feed.fan_out(instance))
+
+
+@receiver(m2m_changed, sender=User.subscribe.through)
+def subscriptions_changed(instance, action, reverse, pk_set, **kwargs):
+    """Дополняет или подрезает ленты при изменении подписок."""
+    if reverse:
+        users, authors = pk_set, (instance.pk,)
+    else:
+        users, authors = (instance.pk,), pk_set
+    if action == 'post_add':
+        feed.backfill(users, authors)
+    elif action == 'post_remove':
+        feed.trim(users, authors)
+    elif action == 'pre_clear':
+        if reverse:
+            feed.trim(author_ids=authors)
+        else:
+            feed.trim(user_ids=users)
+
+
+@receiver((post_save, post_delete), sender=AmountIngredient)
+def recipe_ingredient_changed(instance, **kwargs):
+    bump_recipe_cache('recipe_list', f'recipe:{instance.recipe_id}')
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_relations_changed(instance, action, reverse, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        bump_recipe_cache('recipes')
+    else:
+        bump_recipe_cache('recipe_list', f'recipe:{instance.pk}')
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_save, sender=Recipe)
+def index_name(sender, instance, **kwargs):
+    """Обновляет триграммы названия."""
+    trigrams.index_objects(
+        trigrams.KINDS[sender], ((instance.pk, instance.name),)
+    )
+
+
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_delete, sender=Recipe)
+def unindex_name(sender, instance, **kwargs):
+    """Удаляет триграммы названия."""
+    trigrams.unindex_object(trigrams.KINDS[sender], instance.pk)
+
+
+def changed_links(sender, instance, action, pk_set, own, other):
+    """Id со стороны `other` связей `instance`, изменённых действием
+    `action`; `None` - если на этом шаге учитывать нечего.
+
+    `remove()` передаёт в `pk_set` все запрошенные id, поэтому удаление
+    учитывается на `pre_remove` по строкам таблицы, а тот же `pk_set` в
+    `post_remove` пропускается. `AddDelViewMixin` шлёт только
+    `post_remove` с действительно удалёнными id.
+    """
+    if action == 'post_add':
+        return pk_set
+    if action == 'post_remove':
+        if instance.__dict__.pop('_counted_links', None) is pk_set:
+            return None
+        return pk_set
+    if action not in ('pre_remove', 'pre_clear'):
+        return None
+    links = sender.objects.filter(**{own: instance.pk})
+    if action == 'pre_remove':
+        links = links.filter(**{f'{other}__in': pk_set})
+        instance._counted_links = pk_set
+    return set(links.values_list(other, flat=True))
+
+
+def recipe_marks_changed(sender, instance, action, reverse, pk_set, event):
+    """Меняет счётчик отметок `event` и рейтинг рецептов, возвращает
+    изменённые id со стороны, противоположной `instance`."""
+    own, other = ('user_id', 'recipe_id') if reverse else (
+        'recipe_id', 'user_id'
+    )
+    ids = changed_links(sender, instance, action, pk_set, own, other)
+    if not ids:
+        return None
+    added = action == 'post_add'
+    if reverse:
+        counters.recipe_marked(ids, event, added)
+    else:
+        counters.recipe_marked((instance.pk,), event, added, len(ids))
+    return ids
+
+
+@receiver(m2m_changed, sender=Recipe.favorite.through)
+def favorites_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    recipe_marks_changed(
+        sender, instance, action, reverse, pk_set, 'favorite'
+    )
+
+
+@receiver(m2m_changed, sender=Recipe.cart.through)
+def cart_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Переносит изменения списков покупок в счётчики и итоги."""
+    ids = recipe_marks_changed(
+        sender, instance, action, reverse, pk_set, 'cart'
+    )
+    if not ids:
+        return
+    if reverse:
+        user_ids, recipe_ids = (instance.pk,), ids
+    else:
+        user_ids, recipe_ids = ids, (instance.pk,)
+    ShoppingCartTotal.objects.change_carts(
+        user_ids, recipe_ids, added=action == 'post_add'
+    )
+
+
+@receiver(m2m_changed, sender=User.subscribe.through)
+def subscribers_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    own, other = ('to_user_id', 'from_user_id') if reverse else (
+        'from_user_id', 'to_user_id'
+    )
+    ids = changed_links(sender, instance, action, pk_set, own, other)
+    if not ids:
+        return
+    added = action == 'post_add'
+    if reverse:
+        counters.author_subscribed((instance.pk,), added, len(ids))
+    else:
+        counters.author_subscribed(ids, added)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(instance, **kwargs):
+    """Снимает отметки и подписки удаляемого пользователя со счётчиков:
+    каскад удаляет связи без `m2m_changed`."""
+    for event, through in (
+        ('favorite', Recipe.favorite.through),
+        ('cart', Recipe.cart.through),
+    ):
+        counters.recipe_marked(
+            through.objects.filter(user_id=instance.pk).values('recipe_id'),
+            event,
+            added=False,
+        )
+    counters.author_subscribed(
+        User.subscribe.through.objects.filter(
+            from_user_id=instance.pk
+        ).values('to_user_id'),
+        added=False,
+    )
+
+
+@receiver(pre_save, sender=AmountIngredient)
+def remember_amount(instance, **kwargs):
+    """Запоминает сохранённую строку состава до её изменения."""
+    instance._stored_amount = None
+    if instance.pk is not None:
+        instance._stored_amount = AmountIngredient.objects.filter(
+            pk=instance.pk
+        ).values_list('recipe_id', 'ingredients_id', 'amount').first()
+
+
+@receiver(post_save, sender=AmountIngredient)
+def amount_saved(instance, **kwargs):
+    """Переносит изменение состава рецепта в итоги списков покупок."""
+    old_amounts = {}
+    stored = getattr(instance, '_stored_amount', None)
+    if stored is not None:
+        recipe_id, ingredient_id, amount = stored
+        if recipe_id == instance.recipe_id:
+            old_amounts = {ingredient_id: amount}
+        else:
+            ShoppingCartTotal.objects.change_recipe(
+                Recipe(pk=recipe_id), {ingredient_id: amount}, {}
+            )
+    ShoppingCartTotal.objects.change_recipe(
+        Recipe(pk=instance.recipe_id),
+        old_amounts,
+        {instance.ingredients_id: instance.amount},
+    )
+
+
+@receiver(post_delete, sender=AmountIngredient)
+def amount_deleted(instance, **kwargs):
+    ShoppingCartTotal.objects.change_recipe(
+        Recipe(pk=instance.recipe_id),
+        {instance.ingredients_id: instance.amount},
+        {},
+    )
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleting(instance, **kwargs):
+    """Убирает рецепт из итогов списков покупок.
+
+    Связи с корзинами удаляются сразу, поэтому каскадное удаление
+    состава рецепта итоги уже не меняет.
+    """
+    carts = Recipe.cart.through.objects.filter(recipe_id=instance.pk)
+    ShoppingCartTotal.objects.change_carts(
+        list(carts.values_list('user_id', flat=True)),
+        (instance.pk,),
+        added=False,
+    )
+    carts.delete()
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(instance, created, **kwargs):
+    if created:
+        counters.author_recipes_changed((instance.author_id,), added=True)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(instance, **kwargs):
+    counters.author_recipes_changed((instance.author_id,), added=False)
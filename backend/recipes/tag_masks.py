@@ -0,0 +1,110 @@
+import threading
+from collections import defaultdict
+from itertools import islice
+
+from django.db.models import F, Q, Subquery
+
+from .models import Recipe, Tag
+from .versions import get_version
+
+# Старший бит BigInteger знаковый, поэтому доступно 63 тега.
+MAX_BITS = 63
+BATCH_SIZE = 1000
+
+_tags = None
+_tags_version = None
+_lock = threading.Lock()
+
+
+def get_tags():
+    """`{slug: (id, bit)}` текущего процесса, обновляется по версии тегов."""
+    global _tags, _tags_version
+    version = get_version('tags')
+    if _tags is None or _tags_version != version:
+        with _lock:
+            if _tags is None or _tags_version != version:
+                _tags = {
+                    slug: (pk, bit)
+                    for pk, slug, bit in Tag.objects.values_list(
+                        'id', 'slug', 'bit'
+                    )
+                }
+                _tags_version = version
+    return _tags
+
+
+def free_bit():
+    used = set(
+        Tag.objects.filter(bit__isnull=False).values_list('bit', flat=True)
+    )
+    return next((bit for bit in range(MAX_BITS) if bit not in used), None)
+
+
+def refresh_masks(recipe_ids):
+    """Пересчитывает маски рецептов по таблице связей с тегами."""
+    bits = dict(
+        Tag.objects.filter(bit__isnull=False).values_list('id', 'bit')
+    )
+    recipe_ids = iter(recipe_ids)
+    while True:
+        batch = list(islice(recipe_ids, BATCH_SIZE))
+        if not batch:
+            return
+        masks = defaultdict(int)
+        for recipe_id, tag_id in Recipe.tags.through.objects.filter(
+            recipe_id__in=batch
+        ).values_list('recipe_id', 'tag_id'):
+            if tag_id in bits:
+                masks[recipe_id] |= 1 << bits[tag_id]
+        Recipe.objects.bulk_update(
+            [Recipe(pk=pk, tag_mask=masks[pk]) for pk in batch],
+            ('tag_mask',),
+        )
+
+
+def clear_bit(bit):
+    """Снимает бит удалённого тега со всех рецептов."""
+    Recipe.objects.alias(
+        tag_bit=F('tag_mask').bitand(1 << bit)
+    ).filter(tag_bit__gt=0).update(tag_mask=F('tag_mask').bitand(~(1 << bit)))
+
+
+def rebuild():
+    """Раздаёт биты тегам без них и пересчитывает маски всех рецептов."""
+    for tag in Tag.objects.filter(bit__isnull=True):
+        tag.bit = free_bit()
+        if tag.bit is None:
+            break
+        tag.save(update_fields=('bit',))
+    refresh_masks(Recipe.objects.values_list('id', flat=True).iterator())
+
+
+def filter_by_tags(queryset, slugs, match_all=False):
+    """Фильтр по тегам одним условием на таблицу рецептов.
+
+    Теги без бита (больше `MAX_BITS`) проверяются подзапросом.
+    """
+    tags = get_tags()
+    mask = 0
+    unmasked = []
+    for slug in slugs:
+        pk, bit = tags[slug]
+        if bit is None:
+            unmasked.append(pk)
+        else:
+            mask |= 1 << bit
+    queryset = queryset.alias(tag_bits=F('tag_mask').bitand(mask))
+    through = Recipe.tags.through.objects
+    if match_all:
+        condition = Q(tag_bits=mask)
+        for pk in unmasked:
+            condition &= Q(pk__in=Subquery(
+                through.filter(tag_id=pk).values('recipe_id')
+            ))
+        return queryset.filter(condition)
+    condition = Q(tag_bits__gt=0) if mask else Q(pk__in=())
+    if unmasked:
+        condition |= Q(pk__in=Subquery(
+            through.filter(tag_id__in=unmasked).values('recipe_id')
+        ))
+    return queryset.filter(condition)
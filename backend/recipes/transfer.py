@@ -0,0 +1,81 @@
+import json
+import os
+import time
+
+
+from . import counters, feed, tag_masks, trigrams
+from .models import ShoppingCartTotal, TrigramEntry
+from .versions import bump_version
+
+
+class Checkpoint:
+    """Состояние прерванной выгрузки или загрузки в JSON-файле рядом
+    с данными. Запись атомарна: временный файл и `os.replace`."""
+
+    def __init__(self, data_path):
+        self.path = f'{data_path}.checkpoint'
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, state):
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(temporary, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Progress:
+    """Считает обработанные строки и скорость в строках в секунду."""
+
+    def __init__(self, stdout, rows=0, verbose=False):
+        self.stdout = stdout
+        self.rows = rows
+        self.session_rows = 0
+        self.verbose = verbose
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        return self.session_rows / self.elapsed if self.elapsed else 0
+
+    def add(self, count):
+        self.rows += count
+        self.session_rows += count
+        if self.verbose:
+            self.stdout.write(
+                f'{self.rows} строк, {self.rate:.0f} строк/с'
+            )
+
+    def summary(self):
+        return (
+            f'{self.rows} строк, в этом запуске {self.session_rows} '
+            f'за {self.elapsed:.2f} с ({self.rate:.0f} строк/с)'
+        )
+
+
+def refresh_derived(ingredients_changed=False):
+    """Пересобирает производные таблицы и сбрасывает кеши после
+    массовой загрузки: `bulk_create` не отправляет сигналы."""
+    ShoppingCartTotal.objects.rebuild()
+    feed.rebuild()
+    counters.reconcile()
+    tag_masks.rebuild()
+    trigrams.rebuild(TrigramEntry.RECIPE)
+    if ingredients_changed:
+        trigrams.rebuild(TrigramEntry.INGREDIENT)
+    bump_version('ingredients')
+    bump_version('tags')
+    bump_version('recipes')
@@ -0,0 +1,104 @@
+import re
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, FloatField, Max, Value
+from django.db.models.functions import Cast
+
+from .models import Ingredient, Recipe, TrigramEntry
+
+WORD_RE = re.compile(r'\w+')
+
+MODELS = {
+    TrigramEntry.INGREDIENT: Ingredient,
+    TrigramEntry.RECIPE: Recipe,
+}
+KINDS = {model: kind for kind, model in MODELS.items()}
+
+
+def trigrams(text):
+    """Множество триграмм строки по правилам `pg_trgm`.
+
+    Каждое слово в нижнем регистре дополняется двумя пробелами слева и
+    одним справа.
+    """
+    result = set()
+    for word in WORD_RE.findall(text.casefold()):
+        padded = f'  {word} '
+        result.update(
+            padded[position:position + 3]
+            for position in range(len(padded) - 2)
+        )
+    return result
+
+
+def build_entries(kind, rows):
+    """Строки индекса для пар `(object_id, name)`."""
+    for object_id, name in rows:
+        grams = trigrams(name)
+        for trigram in grams:
+            yield TrigramEntry(
+                kind=kind,
+                object_id=object_id,
+                trigram=trigram,
+                total=len(grams),
+            )
+
+
+@transaction.atomic
+def index_objects(kind, rows):
+    """Переиндексирует объекты `kind` по парам `(object_id, name)`."""
+    rows = list(rows)
+    TrigramEntry.objects.filter(
+        kind=kind, object_id__in=[object_id for object_id, _ in rows]
+    ).delete()
+    TrigramEntry.objects.bulk_create(
+        build_entries(kind, rows), batch_size=settings.TRIGRAM_BATCH_SIZE
+    )
+
+
+def unindex_object(kind, object_id):
+    TrigramEntry.objects.filter(kind=kind, object_id=object_id).delete()
+
+
+@transaction.atomic
+def rebuild(kind):
+    """Строит индекс для всех объектов `kind` заново."""
+    TrigramEntry.objects.filter(kind=kind).delete()
+    TrigramEntry.objects.bulk_create(
+        build_entries(
+            kind,
+            MODELS[kind].objects.values_list('id', 'name').iterator(),
+        ),
+        batch_size=settings.TRIGRAM_BATCH_SIZE,
+    )
+
+
+def search(kind, query, limit=None, threshold=None):
+    """Объекты `kind`, похожие на `query`, в порядке убывания сходства.
+
+    Основная оценка - доля триграмм запроса, найденных в названии (как
+    `word_similarity` в `pg_trgm`), при равенстве - общее сходство
+    |A ∩ B| / |A ∪ B|. Читаются только строки индекса с триграммами
+    запроса. Возвращает список пар `(object_id, score)`.
+    """
+    grams = trigrams(query)
+    if not grams:
+        return []
+    if limit is None:
+        limit = settings.FUZZY_SEARCH_LIMIT
+    if threshold is None:
+        threshold = settings.FUZZY_SEARCH_THRESHOLD
+    shared = Cast(Count('id'), FloatField())
+    matches = TrigramEntry.objects.filter(
+        kind=kind, trigram__in=grams
+    ).values('object_id').annotate(
+        score=shared / Value(len(grams)),
+        similarity=shared / (Value(len(grams)) + Max('total') - shared),
+    ).filter(score__gte=threshold).order_by(
+        '-score', '-similarity', 'object_id'
+    )
+    return [
+        (match['object_id'], match['score'])
+        for match in matches[:limit]
+    ]
@@ -0,0 +1,59 @@
+from django.db.models import F, Max
+from django.utils import timezone
+
+from .models import DataVersion
+
+
+def get_versions(names):
+    """`{name: version}` одним запросом; не менявшиеся наборы - 0."""
+    versions = dict.fromkeys(names, 0)
+    versions.update(
+        DataVersion.objects.filter(name__in=names).values_list(
+            'name', 'version'
+        )
+    )
+    return versions
+
+
+def get_version(name):
+    """Текущая версия набора данных `name`.
+
+    Хранится в базе, поэтому сдвиг виден всем процессам и только после
+    фиксации транзакции, изменившей данные.
+    """
+    return get_versions((name,))[name]
+
+
+def get_modified(name):
+    """Время последнего изменения набора данных `name` в секундах."""
+    modified = DataVersion.objects.filter(name=name).values_list(
+        'modified', flat=True
+    ).first()
+    if modified is None:
+        DataVersion.objects.bulk_create(
+            (DataVersion(name=name, modified=timezone.now()),),
+            ignore_conflicts=True,
+        )
+        return get_modified(name)
+    return int(modified.timestamp())
+
+
+def get_last_modified(names):
+    """Последнее изменение среди наборов `names` в секундах, `None` -
+    если ни один ещё не менялся."""
+    modified = DataVersion.objects.filter(name__in=names).aggregate(
+        modified=Max('modified')
+    )['modified']
+    return None if modified is None else int(modified.timestamp())
+
+
+def bump_version(name):
+    """Сдвигает версию набора данных `name` после изменения."""
+    now = timezone.now()
+    if not DataVersion.objects.filter(name=name).update(
+        version=F('version') + 1, modified=now
+    ):
+        DataVersion.objects.bulk_create(
+            (DataVersion(name=name, version=1, modified=now),),
+            ignore_conflicts=True,
+        )
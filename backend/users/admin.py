@@ -8,6 +8,7 @@ class UserAdmin(ModelAdmin):
     """Предоставление категории пользователей в админке."""
     list_display = (
         'username', 'first_name', 'last_name', 'email',
+        'recipes_count', 'subscribers_count',
     )
     fields = (
         ('username', 'email',),
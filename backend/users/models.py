@@ -41,6 +41,16 @@ class User(AbstractUser):
         to='self',
         symmetrical=False,
     )
+    recipes_count = models.PositiveIntegerField(
+        'Рецептов',
+        default=0,
+        editable=False,
+    )
+    subscribers_count = models.PositiveIntegerField(
+        'Подписчиков',
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         ordering = ('username',)